@@ -2,31 +2,62 @@
 Centralized logging configuration using Loguru.
 """
 from loguru import logger
+import os
+import shutil
 import sys
+import threading
+import zipfile
 from pathlib import Path
 
+from .middleware.request_id import request_id_ctx
+
+_ZIP_CHUNK = 1 << 20
+
+
+def _zip_log(path: str) -> None:
+    """Zip a rotated log file and remove the original once the archive is complete"""
+    archive = f"{path}.zip"
+    partial = f"{archive}.tmp"
+    with open(path, "rb", buffering=_ZIP_CHUNK) as src, \
+            zipfile.ZipFile(partial, "w", zipfile.ZIP_DEFLATED, compresslevel=1) as zf, \
+            zf.open(os.path.basename(path), "w") as dst:
+        shutil.copyfileobj(src, dst, _ZIP_CHUNK)
+    os.replace(partial, archive)
+    os.remove(path)
+
+
+def _compress_in_background(path: str) -> None:
+    # Compressing a large log takes seconds; don't stall the sink while it runs
+    threading.Thread(target=_zip_log, args=(path,), name="log-compress", daemon=True).start()
+
+
 # Remove default handler
 logger.remove()
 
+# Stamp every record with the current request ID (see RequestIdMiddleware)
+logger.configure(patcher=lambda record: record["extra"].setdefault("request_id", request_id_ctx.get()))
+
 # Console handler - colored output with timestamp
 logger.add(
     sys.stderr,
-    format="<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>",
+    format="<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | {extra[request_id]} | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>",
     level="INFO",
     colorize=True,
+    enqueue=True,  # Format/write on Loguru's worker thread, not the request path
 )
 
 # File handler - detailed logs with rotation
-log_dir = Path(__file__).parent.parent / "logs"
-log_dir.mkdir(exist_ok=True)
+log_dir = Path(os.getenv("APP_LOG_PATH", Path(__file__).parent.parent / "logs"))
+log_dir.mkdir(parents=True, exist_ok=True)
 
 logger.add(
     log_dir / "app_{time:YYYY-MM-DD}.log",
-    format="{time:YYYY-MM-DD HH:mm:ss.SSS} | {level: <8} | {name}:{function}:{line} - {message}",
+    format="{time:YYYY-MM-DD HH:mm:ss.SSS} | {level: <8} | {extra[request_id]} | {name}:{function}:{line} - {message}",
     level="DEBUG",
     rotation="00:00",  # Rotate at midnight
     retention="30 days",  # Keep logs for 30 days
-    compression="zip",  # Compress old logs
+    compression=_compress_in_background,  # Zip old logs off the logging thread
+    enqueue=True,
 )
 
 # Export logger
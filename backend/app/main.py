@@ -1,64 +1,139 @@
+import asyncio
+import hashlib
+import hmac
 import os
+import stat
 import time
-import uuid
-import threading
 import traceback
+import zlib
+from contextlib import asynccontextmanager
+from email.utils import formatdate
 from pathlib import Path
-from typing import Dict
-from fastapi import FastAPI, HTTPException, Header, Depends
+from secrets import token_hex
+from typing import Optional, Set
+from urllib.parse import quote
+from fastapi import FastAPI, HTTPException, Header, Depends, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 
 from . import schemas
-from . import orchestrator
 from .logger import logger
+from .middleware.request_id import RequestIdMiddleware, get_request_id
+from .paths import ASSETS_DIR, LOG_DIR
+from .progress import progress_store
 
 
-BASE_DIR = Path(__file__).resolve().parent.parent
+_ASSETS_ROOT = ASSETS_DIR.resolve()
+_LOG_ROOT = LOG_DIR.resolve()
 
-# Assets directory: use Railway volume mount if available, fallback to local
-# Railway volume will be mounted at /app/assets in production
-ASSETS_DIR = Path(os.getenv("ASSETS_PATH", BASE_DIR.parent / "assets"))
-ASSETS_DIR.mkdir(parents=True, exist_ok=True)
-
-# Logs directory for analytics/feedback CSV files
-LOG_DIR = Path(os.getenv("SESSION_LOG_PATH", ASSETS_DIR / "logs"))
-LOG_DIR.mkdir(parents=True, exist_ok=True)
+# When nginx fronts the app, hand asset downloads to it via X-Accel-Redirect
+# (e.g. NGINX_ASSETS_PREFIX=/internal-assets/ mapped to ASSETS_PATH as an internal location)
+NGINX_ASSETS_PREFIX = os.getenv("NGINX_ASSETS_PREFIX")
 
 # Admin authentication token
 ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "change-this-in-production")
+ADMIN_TOKEN_BYTES = ADMIN_TOKEN.encode()
+
+# Generation concurrency: at most GENERATION_MAX_CONCURRENCY jobs run at once and
+# at most GENERATION_MAX_QUEUED wait for a slot; beyond that we answer 429
+GENERATION_MAX_CONCURRENCY = int(os.getenv("GENERATION_MAX_CONCURRENCY", 8))
+GENERATION_MAX_QUEUED = int(os.getenv("GENERATION_MAX_QUEUED", 16))
+_generation_slots = asyncio.Semaphore(GENERATION_MAX_CONCURRENCY)
+_running_jobs = 0
+_queued_jobs = 0
+# Generations accepted by either endpoint and not finished yet (running, waiting for a slot,
+# or a background task that hasn't reached the slot queue); bounded by the backlog limit
+_admitted_jobs = 0
+
+# Strong references to pending/running generation tasks (the event loop only keeps weak ones)
+_background_jobs: Set[asyncio.Task] = set()
+
+# How often the progress sweeper evicts finished jobs and reports store size
+PROGRESS_SWEEP_SECONDS = int(os.getenv("GENERATION_PROGRESS_SWEEP_SECONDS", 5 * 60))
 
-# In-memory progress store (use Redis for production)
-_generation_status: Dict[str, schemas.GenerationProgress] = {}
 
-app = FastAPI(title="Schneider CFI Backend", version="0.1.0")
+async def _sweep_progress():
+    while True:
+        await asyncio.sleep(PROGRESS_SWEEP_SECONDS)
+        tracked = await progress_store.sweep()
+        if tracked is not None:
+            logger.info("Generation progress sweep", tracked_jobs=tracked)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    sweeper = asyncio.create_task(_sweep_progress())
+    try:
+        yield
+    finally:
+        sweeper.cancel()
+        # Drain records still queued for the enqueued log sinks
+        await logger.complete()
 
-allowed_origin = os.getenv("ALLOWED_ORIGIN", "*")
+
+app = FastAPI(title="Schneider CFI Backend", version="0.1.0", lifespan=lifespan)
+
+# ALLOWED_ORIGIN may be a comma-separated list. A wildcard can't be combined with
+# credentials (browsers reject the response), so credentials are only allowed for explicit origins.
+allowed_origins = [o.strip() for o in os.getenv("ALLOWED_ORIGIN", "*").split(",") if o.strip()] or ["*"]
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=[allowed_origin] if allowed_origin != "*" else ["*"],
-    allow_credentials=True,
+    allow_origins=allowed_origins,
+    allow_credentials="*" not in allowed_origins,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID"],
 )
+# Added last so it is the outermost middleware and every response carries the ID
+app.add_middleware(RequestIdMiddleware)
+
 
-app.mount("/assets", StaticFiles(directory=str(ASSETS_DIR)), name="assets")
+@app.api_route("/assets/{asset_path:path}", methods=["GET", "HEAD"], include_in_schema=False)
+async def serve_asset(asset_path: str):
+    """Serve generated images/boards; session logs are only available via the admin endpoints"""
+    file_path = (_ASSETS_ROOT / asset_path).resolve()
+    if not file_path.is_relative_to(_ASSETS_ROOT) or file_path.is_relative_to(_LOG_ROOT):
+        raise HTTPException(status_code=404, detail="Not Found")
+    try:
+        stat_result = file_path.stat()
+    except (FileNotFoundError, NotADirectoryError):
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not stat.S_ISREG(stat_result.st_mode):
+        raise HTTPException(status_code=404, detail="Not Found")
+
+    if NGINX_ASSETS_PREFIX:
+        relative = file_path.relative_to(_ASSETS_ROOT).as_posix()
+        return Response(headers={"X-Accel-Redirect": f"{NGINX_ASSETS_PREFIX.rstrip('/')}/{quote(relative)}"})
+    return FileResponse(file_path, stat_result=stat_result)
 
 
 @app.get("/healthz")
-def healthz():
+async def healthz():
     return {"status": "ok", "time": int(time.time())}
 
 
+@app.get("/metrics")
+async def metrics():
+    return {
+        "generation": {
+            "running": _running_jobs,
+            "queued": _queued_jobs,
+            "max_concurrency": GENERATION_MAX_CONCURRENCY,
+            "max_queued": GENERATION_MAX_QUEUED,
+        }
+    }
+
+
 @app.post("/api/boards/preview", response_model=schemas.PreviewResponse)
-def api_preview(req: schemas.PreviewRequest):
-    request_id = uuid.uuid4().hex[:8]
+async def api_preview(req: schemas.PreviewRequest):
+    request_id = get_request_id()
     try:
-        logger.info("Preview request", request_id=request_id, session_id=req.session_id)
-        return orchestrator.handle_preview(req)
+        logger.info("Preview request", session_id=req.session_id)
+        # Imported on first use: it pulls in OpenAI/PIL/ReportLab, which would slow cold start
+        from . import orchestrator
+        return await orchestrator.handle_preview(req)
     except Exception as e:
-        logger.error("Preview request failed", request_id=request_id, error=str(e), exc_info=True)
+        logger.error("Preview request failed", error=str(e), exc_info=True)
         detail = {"message": str(e), "request_id": request_id}
         session_id = getattr(e, "session_id", None) or req.session_id
         if session_id:
@@ -66,86 +141,131 @@ def api_preview(req: schemas.PreviewRequest):
         raise HTTPException(status_code=400, detail=detail)
 
 
+def _admit_generation() -> None:
+    """Reserve a place in the generation backlog or answer 429; release it with _finish_generation"""
+    global _admitted_jobs
+    if _admitted_jobs >= GENERATION_MAX_CONCURRENCY + GENERATION_MAX_QUEUED:
+        logger.warning("Generation backlog full", running=_running_jobs, queued=_queued_jobs)
+        raise HTTPException(status_code=429, detail={"message": "השרת עמוס כרגע, נסה שוב בעוד רגע."})
+    _admitted_jobs += 1
+
+
+def _finish_generation() -> None:
+    global _admitted_jobs
+    _admitted_jobs -= 1
+
+
+async def _generate_in_slot(req: schemas.GenerateRequest, job_id: Optional[str] = None) -> schemas.GenerateResponse:
+    """Run one generation once a slot frees up; shared by the blocking and the job endpoints"""
+    global _running_jobs, _queued_jobs
+    _queued_jobs += 1
+    try:
+        await _generation_slots.acquire()
+    finally:
+        _queued_jobs -= 1
+
+    _running_jobs += 1
+    try:
+        from . import orchestrator
+        return await orchestrator.handle_generate(req, str(ASSETS_DIR), job_id)
+    finally:
+        _running_jobs -= 1
+        _generation_slots.release()
+
+
+async def _run_generation(job_id: str, req: schemas.GenerateRequest) -> None:
+    """Background body of a generation job; reports the outcome through progress_store"""
+    try:
+        result = await _generate_in_slot(req, job_id)
+        # Store assets before flipping status so pollers never see "completed" without them
+        await progress_store.set_assets(job_id, result.assets)
+        await progress_store.update(
+            job_id,
+            status="completed",
+            completed_count=len(req.parsed.entities),
+            message="הלוח מוכן!",
+            current_entity=None,
+        )
+    except Exception as e:
+        logger.error("Async generation failed", job_id=job_id, error=str(e), exc_info=True)
+        await progress_store.update(job_id, status="error", message=f"שגיאה: {str(e)}")
+    finally:
+        _finish_generation()
+
+
 @app.post("/api/boards/generate", response_model=schemas.GenerateResponse)
-def api_generate(req: schemas.GenerateRequest):
-    request_id = uuid.uuid4().hex[:8]
-    session_id = req.session_id or uuid.uuid4().hex
+async def api_generate(req: schemas.GenerateRequest):
+    request_id = get_request_id()
+    session_id = req.session_id or token_hex(16)
     if not req.session_id:
-        req = req.copy(update={"session_id": session_id})
+        req.session_id = session_id
+    # Blocking calls wait for the same slots as jobs, so they count against the same backlog
+    _admit_generation()
     try:
-        logger.info("Generate request", request_id=request_id, session_id=session_id)
-        return orchestrator.handle_generate(req, assets_dir=str(ASSETS_DIR))
+        logger.info("Generate request", session_id=session_id)
+        return await _generate_in_slot(req)
     except Exception as e:
-        logger.error("Generate request failed", request_id=request_id, session_id=session_id, error=str(e), exc_info=True)
+        logger.error("Generate request failed", session_id=session_id, error=str(e), exc_info=True)
         detail = {"message": str(e), "request_id": request_id}
         detail["session_id"] = getattr(e, "session_id", session_id)
         raise HTTPException(status_code=400, detail=detail)
+    finally:
+        _finish_generation()
 
 
 @app.post("/api/boards/generate/start", response_model=schemas.GenerateStartResponse)
-def api_generate_start(req: schemas.GenerateRequest):
+async def api_generate_start(req: schemas.GenerateRequest):
     """Start async generation and return job_id"""
-    job_id = uuid.uuid4().hex[:8]
-    session_id = req.session_id or uuid.uuid4().hex
+    # Counts from here, not from when the task reaches the slot queue, so a burst can't overshoot
+    _admit_generation()
+    job_id = token_hex(4)
+    session_id = req.session_id or token_hex(16)
     if not req.session_id:
-        req = req.copy(update={"session_id": session_id})
+        req.session_id = session_id
     
     # Initialize progress
-    _generation_status[job_id] = schemas.GenerationProgress(
-        status="in_progress",
-        completed_count=0,
-        total_count=len(req.parsed.entities),
-        message="מתחיל ליצור תמונות..."
-    )
+    total_count = len(req.parsed.entities)
+    try:
+        await progress_store.create(job_id, schemas.GenerationProgress(
+            status="in_progress",
+            completed_count=0,
+            total_count=total_count,
+            message="מתחיל ליצור תמונות..."
+        ))
+    except BaseException:
+        # The job never started, so it won't release its place itself
+        _finish_generation()
+        raise
     
-    # Run in background thread
-    def _run():
-        try:
-            result = orchestrator.handle_generate(req, str(ASSETS_DIR), job_id)
-            _generation_status[job_id].status = "completed"
-            _generation_status[job_id].message = "הלוח מוכן!"
-            # Store assets in progress object
-            if job_id in _generation_status:
-                _generation_status[job_id] = schemas.GenerationProgress(
-                    status="completed",
-                    completed_count=_generation_status[job_id].total_count,
-                    total_count=_generation_status[job_id].total_count,
-                    message="הלוח מוכן!",
-                    current_entity=None
-                )
-                # We'll need to store assets separately
-                _generation_status[f"{job_id}_assets"] = result.assets
-        except Exception as e:
-            logger.error("Async generation failed", job_id=job_id, error=str(e), exc_info=True)
-            if job_id in _generation_status:
-                _generation_status[job_id].status = "error"
-                _generation_status[job_id].message = f"שגיאה: {str(e)}"
-    
-    threading.Thread(target=_run, daemon=True).start()
+    # Run as a background task on the event loop, once a generation slot frees up; it
+    # releases its backlog place when it finishes
+    task = asyncio.create_task(_run_generation(job_id, req))
+    _background_jobs.add(task)
+    task.add_done_callback(_background_jobs.discard)
     return schemas.GenerateStartResponse(job_id=job_id, session_id=session_id, user_name=req.user_name)
 
 
 @app.get("/api/boards/generate/status/{job_id}", response_model=schemas.ProgressResponse)
-def api_generate_status(job_id: str):
+async def api_generate_status(job_id: str):
     """Poll generation progress"""
-    if job_id not in _generation_status:
+    progress = await progress_store.get(job_id)
+    if progress is None:
         raise HTTPException(status_code=404, detail="Job not found")
     
-    progress = _generation_status[job_id]
     assets = None
     
     # Check if assets are available
-    if progress.status == "completed" and f"{job_id}_assets" in _generation_status:
-        assets = _generation_status[f"{job_id}_assets"]
+    if progress.status == "completed":
+        assets = await progress_store.get_assets(job_id)
     
     return schemas.ProgressResponse(progress=progress, assets=assets)
 
 
 @app.post("/api/feedback")
-def api_feedback(req: schemas.FeedbackRequest):
+async def api_feedback(req: schemas.FeedbackRequest):
     """Record user feedback for a session"""
-    request_id = uuid.uuid4().hex[:8]
-    logger.info("Feedback received", request_id=request_id, session_id=req.session_id, rating=req.rating)
+    request_id = get_request_id()
+    logger.info("Feedback received", session_id=req.session_id, rating=req.rating)
     
     try:
         from .tools import conversation_logger
@@ -156,7 +276,7 @@ def api_feedback(req: schemas.FeedbackRequest):
         )
         return {"status": "ok"}
     except Exception as e:
-        logger.error("Feedback submission failed", request_id=request_id, error=str(e), exc_info=True)
+        logger.error("Feedback submission failed", error=str(e), exc_info=True)
         raise HTTPException(status_code=400, detail={"message": str(e), "request_id": request_id})
 
 
@@ -170,17 +290,96 @@ def verify_admin_token(authorization: str = Header(None)):
         raise HTTPException(status_code=401, detail="Missing authorization header")
     
     # Support both "Bearer TOKEN" and just "TOKEN" format
-    token = authorization.replace("Bearer ", "").strip()
+    token = authorization.removeprefix("Bearer ").strip()
     
-    if token != ADMIN_TOKEN:
+    # Constant-time compare; bytes so non-ASCII input can't raise
+    if not hmac.compare_digest(token.encode(), ADMIN_TOKEN_BYTES):
         logger.warning("Unauthorized admin access attempt")
         raise HTTPException(status_code=401, detail="Invalid admin token")
     
     return token
 
 
+_GZIP_CHUNK = 64 * 1024
+
+
+def _gzip_file_chunks(file_path: Path):
+    """Yield the file gzip-compressed in 64 KiB chunks (level 1: cheap CPU, most of the win on NDJSON)"""
+    compressor = zlib.compressobj(1, zlib.DEFLATED, 31)  # wbits=31 -> gzip container
+    with open(file_path, "rb") as fp:
+        while chunk := fp.read(_GZIP_CHUNK):
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+    yield compressor.flush()
+
+
+def _accepts_gzip(accept_encoding: str) -> bool:
+    """Whether an Accept-Encoding header allows gzip; a q-value of 0 is a refusal"""
+    gzip_q = wildcard_q = None
+    for coding in accept_encoding.split(","):
+        name, *params = (part.strip() for part in coding.split(";"))
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        name = name.lower()
+        if name in ("gzip", "x-gzip"):
+            gzip_q = q
+        elif name == "*":
+            wildcard_q = q
+    # An explicit gzip entry wins over the wildcard
+    q = gzip_q if gzip_q is not None else wildcard_q
+    return q is not None and q > 0
+
+
+def _conditional_file_response(
+    file_path: Path,
+    stat_result: os.stat_result,
+    filename: str,
+    media_type: str,
+    if_none_match: Optional[str],
+    accept_encoding: Optional[str] = None,
+) -> Response:
+    """FileResponse with ETag/Last-Modified; answers 304 when the client already has this version
+
+    Pass accept_encoding to stream the file gzip-compressed to clients that accept it.
+    """
+    gzip = bool(accept_encoding) and _accepts_gzip(accept_encoding)
+    # mtime+size identifies the file version; hashing ~30 bytes is effectively free
+    version = f"{stat_result.st_mtime_ns}-{stat_result.st_size}".encode()
+    digest = hashlib.blake2b(version, digest_size=8).hexdigest()
+    etag = f'"{digest}-gzip"' if gzip else f'"{digest}"'
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "Cache-Control": "private, max-age=60",
+    }
+    if accept_encoding is not None:
+        headers["Vary"] = "Accept-Encoding"
+    if if_none_match:
+        client_tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if etag in client_tags or "*" in client_tags:
+            return Response(status_code=304, headers=headers)
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+        headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return StreamingResponse(_gzip_file_chunks(file_path), media_type=media_type, headers=headers)
+    return FileResponse(
+        path=str(file_path),
+        filename=filename,
+        media_type=media_type,
+        headers=headers,
+        stat_result=stat_result,
+    )
+
+
 @app.get("/api/admin/logs/kpis")
-def download_kpis(token: str = Depends(verify_admin_token)):
+async def download_kpis(token: str = Depends(verify_admin_token), if_none_match: Optional[str] = Header(None)):
     """Download conversation KPIs CSV file
     
     Contains session summaries with metrics like duration, images created, etc.
@@ -191,42 +390,43 @@ def download_kpis(token: str = Depends(verify_admin_token)):
              -o kpis.csv
     """
     file_path = LOG_DIR / "conversation_kpis.csv"
-    if not file_path.exists():
+    try:
+        stat_result = file_path.stat()
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="KPIs file not found. No sessions recorded yet.")
     
-    logger.info("Admin downloading KPIs file", file_size=file_path.stat().st_size)
-    return FileResponse(
-        path=str(file_path),
-        filename="conversation_kpis.csv",
-        media_type="text/csv"
-    )
+    logger.info("Admin downloading KPIs file", file_size=stat_result.st_size)
+    return _conditional_file_response(file_path, stat_result, "conversation_kpis.csv", "text/csv", if_none_match)
 
 
 @app.get("/api/admin/logs/details")
-def download_details(token: str = Depends(verify_admin_token)):
+async def download_details(
+    token: str = Depends(verify_admin_token),
+    if_none_match: Optional[str] = Header(None),
+    accept_encoding: str = Header(""),
+):
     """Download detailed conversation logs (NDJSON format)
     
     Contains full conversation history, LLM outputs, errors, and assets for each session.
+    Sent gzip-compressed when the client accepts it (NDJSON compresses ~10x).
     
     Usage:
-        curl -H "Authorization: Bearer YOUR_TOKEN" \
+        curl --compressed -H "Authorization: Bearer YOUR_TOKEN" \
              https://your-backend.railway.app/api/admin/logs/details \
              -o details.ndjson
     """
     file_path = LOG_DIR / "conversation_details.ndjson"
-    if not file_path.exists():
+    try:
+        stat_result = file_path.stat()
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="Details file not found. No sessions recorded yet.")
     
-    logger.info("Admin downloading details file", file_size=file_path.stat().st_size)
-    return FileResponse(
-        path=str(file_path),
-        filename="conversation_details.ndjson",
-        media_type="application/x-ndjson"
-    )
+    logger.info("Admin downloading details file", file_size=stat_result.st_size)
+    return _conditional_file_response(file_path, stat_result, "conversation_details.ndjson", "application/x-ndjson", if_none_match, accept_encoding)
 
 
 @app.get("/api/admin/logs/feedback")
-def download_feedback(token: str = Depends(verify_admin_token)):
+async def download_feedback(token: str = Depends(verify_admin_token), if_none_match: Optional[str] = Header(None)):
     """Download user feedback CSV file
     
     Contains user ratings and comments for each session.
@@ -237,14 +437,12 @@ def download_feedback(token: str = Depends(verify_admin_token)):
              -o feedback.csv
     """
     file_path = LOG_DIR / "user_feedback.csv"
-    if not file_path.exists():
+    try:
+        stat_result = file_path.stat()
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="Feedback file not found. No feedback submitted yet.")
     
-    logger.info("Admin downloading feedback file", file_size=file_path.stat().st_size)
-    return FileResponse(
-        path=str(file_path),
-        filename="user_feedback.csv",
-        media_type="text/csv"
-    )
+    logger.info("Admin downloading feedback file", file_size=stat_result.st_size)
+    return _conditional_file_response(file_path, stat_result, "user_feedback.csv", "text/csv", if_none_match)
 
 
@@ -0,0 +1,55 @@
+"""
+Pure ASGI middleware that tags every HTTP request with a short request ID.
+
+The ID is taken from an incoming X-Request-ID header when it looks sane,
+otherwise generated. It is stored in a ContextVar (so Loguru can stamp it on
+every record, including work run via asyncio.to_thread or background tasks
+spawned by the request) and echoed back in the X-Request-ID response header.
+"""
+import re
+from contextvars import ContextVar
+from secrets import token_hex
+
+REQUEST_ID_HEADER = b"x-request-id"
+
+# Accept client-supplied IDs only if they can't inject anything into log lines
+_VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+request_id_ctx: ContextVar[str] = ContextVar("request_id", default="-")
+
+
+def get_request_id() -> str:
+    return request_id_ctx.get()
+
+
+class RequestIdMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == REQUEST_ID_HEADER:
+                candidate = value.decode("latin-1")
+                if _VALID_REQUEST_ID.match(candidate):
+                    request_id = candidate
+                break
+        if request_id is None:
+            request_id = token_hex(4)
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((REQUEST_ID_HEADER, request_id.encode("latin-1")))
+                message["headers"] = headers
+            await send(message)
+
+        token = request_id_ctx.set(request_id)
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            request_id_ctx.reset(token)
@@ -1,5 +1,7 @@
+import asyncio
 import time
-import uuid
+from types import MappingProxyType
+from secrets import token_hex
 from typing import Dict
 
 from . import schemas
@@ -10,16 +12,45 @@ from .tools.labels import generate_labels
 from .tools.render import render_board
 from .tools import conversation_logger
 from .logger import logger
+from .progress import progress_store
+
+
+# Fallbacks for image prompts when the therapist left these profile fields empty
+_IMAGE_PROFILE_DEFAULTS = {"age": 10, "gender": "child"}
+# Entity substrings that mark an untitled board as a breakfast board
+_BREAKFAST_KEYWORDS = frozenset(["breakfast", "לחם", "חלב", "ביצה", "בוקר"])
+# Patient fields echoed back in the preview profile
+_PREVIEW_PATIENT_FIELDS = tuple(
+    name for name in schemas.PreviewProfile.model_fields if name in schemas.PatientProfile.model_fields
+)
+
+
+def _preview_profile(norm: Dict, patient: schemas.PatientProfile) -> schemas.PreviewProfile:
+    # Every value here is already validated (request model / normalize_profile), so skip re-validation
+    fields = patient.__dict__
+    return schemas.PreviewProfile.model_construct(
+        labels_languages=norm["labels_languages"],
+        image_style=norm["image_style"],
+        **{name: fields[name] for name in _PREVIEW_PATIENT_FIELDS},
+    )
 
 
-def handle_preview(req: schemas.PreviewRequest) -> schemas.PreviewResponse:
+async def handle_preview(req: schemas.PreviewRequest) -> schemas.PreviewResponse:
     """
     Step 1: Use LLM to understand user intent and create a plan
     """
-    t0 = time.time()
-    session_id = req.session_id or uuid.uuid4().hex
+    session_id = req.session_id or token_hex(16)
+
+    # One pass over the history builds both the log payload and the LLM context.
+    # The history models are flat, so their field dicts can be used as-is.
+    history_payload = []
+    context_lines = []
+    for msg in req.conversation_history:
+        fields = msg.__dict__
+        history_payload.append(fields)
+        context_lines.append(f"{fields['role']}: {fields['text']}")
+    conversation_context = "\n".join(context_lines)
 
-    history_payload = [msg.model_dump() for msg in req.conversation_history]
     conversation_logger.record_preview_request(
         session_id=session_id,
         user_name=req.user_name,
@@ -30,15 +61,11 @@ def handle_preview(req: schemas.PreviewRequest) -> schemas.PreviewResponse:
     try:
         # Normalize profile
         norm = normalize_profile(req.patient_profile, req.preferences)
-        
-        # Build conversation context for LLM
-        conversation_context = "\n".join([
-            f"{msg.role}: {msg.text}" for msg in req.conversation_history
-        ])
+        # Same profile echo for both the clarification and the plan response
+        preview_profile = _preview_profile(norm, req.patient_profile)
         
         # Use LLM to understand the request
-        patient_dict = req.patient_profile.model_dump() if hasattr(req.patient_profile, "model_dump") else dict(req.patient_profile)
-        llm_result = understand_request(req.board_description, patient_dict, conversation_context)
+        llm_result = await understand_request(req.board_description, req.patient_profile, conversation_context)
 
         # Check if LLM needs clarification
         if llm_result.get("needs_clarification"):
@@ -52,16 +79,7 @@ def handle_preview(req: schemas.PreviewRequest) -> schemas.PreviewResponse:
             )
             return schemas.PreviewResponse(
                 parsed=schemas.ParsedBoard(topic=None, entities=[], layout="2x4"),
-                profile=schemas.PreviewProfile(
-                    labels_languages=norm["labels_languages"], 
-                    image_style=norm["image_style"],
-                    age=req.patient_profile.age,
-                    gender=req.patient_profile.gender,
-                    language=req.patient_profile.language,
-                    can_read=req.patient_profile.can_read,
-                    religion=req.patient_profile.religion,
-                    sector=req.patient_profile.sector
-                ),
+                profile=preview_profile,
                 checks=schemas.Checks(ok=False, missing=["clarification_needed"]),
                 summary=summary_text,
                 session_id=session_id,
@@ -88,16 +106,7 @@ def handle_preview(req: schemas.PreviewRequest) -> schemas.PreviewResponse:
 
         return schemas.PreviewResponse(
             parsed=parsed,
-            profile=schemas.PreviewProfile(
-                labels_languages=norm["labels_languages"], 
-                image_style=norm["image_style"],
-                age=req.patient_profile.age,
-                gender=req.patient_profile.gender,
-                language=req.patient_profile.language,
-                can_read=req.patient_profile.can_read,
-                religion=req.patient_profile.religion,
-                sector=req.patient_profile.sector
-            ),
+            profile=preview_profile,
             checks=schemas.Checks(ok=checks["ok"], missing=checks["missing"]),
             summary=summary_text,
             session_id=session_id,
@@ -110,41 +119,47 @@ def handle_preview(req: schemas.PreviewRequest) -> schemas.PreviewResponse:
         raise
 
 
-def handle_generate(req: schemas.GenerateRequest, assets_dir: str, job_id: str = None) -> schemas.GenerateResponse:
+async def handle_generate(req: schemas.GenerateRequest, assets_dir: str, job_id: str = None) -> schemas.GenerateResponse:
     """
     Step 2: Use LLM to build image prompts, then generate with Google
     """
     from pathlib import Path
-    from .tools.image_gen import _generate_with_gemini, _generate_placeholder
+    from .tools.image_gen import generate_images
     
-    t_images_start = time.time()
-    session_id = req.session_id or uuid.uuid4().hex
+    t_images_start = time.perf_counter_ns()
+    session_id = req.session_id or token_hex(16)
     conversation_logger.record_generate_start(session_id, len(req.parsed.entities))
 
     try:
+        # Reject boards that can't be rendered before paying for any LLM/Gemini calls
+        checks = validate_requirements({}, {"layout": req.parsed.layout, "entities": req.parsed.entities})
+        if not checks["ok"]:
+            raise ValueError("לא ניתן ליצור את הלוח: מספר הפריטים לא מתאים לפריסה שנבחרה.")
+
+        # One read-only view of the profile fields, shared by every step below
+        profile_view = MappingProxyType(req.profile.__dict__)
+
         # Use LLM to build detailed prompts for each entity
-        profile_dict = req.profile.model_dump() if hasattr(req.profile, "model_dump") else dict(req.profile)
-        
         # Create a working copy with defaults for image generation
         # but keep original profile for display/transparency
-        working_profile = profile_dict.copy()
-        if 'age' not in working_profile or working_profile['age'] is None:
-            working_profile['age'] = 10
-        if 'gender' not in working_profile or working_profile['gender'] is None:
-            working_profile['gender'] = 'child'
+        working_profile = dict(profile_view)
+        for key, default in _IMAGE_PROFILE_DEFAULTS.items():
+            if working_profile.get(key) is None:
+                working_profile[key] = default
         
         # Build board context from topic and title
         board_context = req.parsed.topic if hasattr(req.parsed, 'topic') and req.parsed.topic else req.title
         if not board_context or board_context == "לוח תקשורת מותאם":
             # Try to infer context from entities
-            if any(word in str(req.parsed.entities).lower() for word in ["breakfast", "לחם", "חלב", "ביצה", "בוקר"]):
+            lowered = [entity.lower() for entity in req.parsed.entities]
+            if any(keyword in entity for entity in lowered for keyword in _BREAKFAST_KEYWORDS):
                 board_context = "breakfast / ארוחת בוקר"
         
         try:
-            prompts = build_image_prompts(
+            prompts = await build_image_prompts(
                 req.parsed.entities,
                 working_profile,  # Use working profile with defaults for image generation
-                req.profile.image_style,
+                profile_view["image_style"],
                 board_context
             )
             logger.info("LLM prompts generated", 
@@ -161,44 +176,47 @@ def handle_generate(req: schemas.GenerateRequest, assets_dir: str, job_id: str =
         assets = Path(assets_dir)
         max_attempts = 2
 
-        if job_id:
-            from .main import _generation_status
-
         for attempt in range(1, max_attempts + 1):
             image_paths = []
+            # Generated bytes by filename, so rendering doesn't re-read what was just written
+            image_bytes: Dict[str, bytes] = {}
             try:
-                if job_id and job_id in _generation_status:
-                    _generation_status[job_id].message = "יוצר תמונות..."
-
-                for i, item in enumerate(prompts):
-                    entity = item.get("entity", "item")
-                    prompt_text = item.get("prompt", entity)
-
-                    if job_id and job_id in _generation_status:
-                        _generation_status[job_id].current_entity = entity
-                        _generation_status[job_id].completed_count = i
-                        _generation_status[job_id].message = f"יוצר תמונה: {entity}..."
-
-                    filename = _generate_with_gemini(entity, prompt_text, assets, prefix=session_id)
-                    if not filename:
-                        filename = _generate_placeholder(entity, assets, prefix=session_id)
+                if job_id:
+                    await progress_store.update(job_id, message="יוצר תמונות...")
 
+                async def _on_image(entity: str, filename: str) -> None:
+                    # Runs on the event loop as each image lands, so plain list/counter updates are safe
                     image_paths.append(filename)
+                    if job_id:
+                        await progress_store.update(
+                            job_id,
+                            current_entity=entity,
+                            completed_count=len(image_paths),
+                            message=f"נוצרה תמונה: {entity} ({len(image_paths)}/{len(prompts)})",
+                        )
+
+                # All entities are requested at once. image_paths fills in completion order (so a
+                # failed attempt can clean up), then is replaced with the entity-ordered result
+                image_paths[:] = await generate_images(
+                    prompts, assets_dir, prefix=session_id, on_complete=_on_image, image_bytes=image_bytes,
+                )
 
                 if len(image_paths) != len(req.parsed.entities):
                     raise RuntimeError(
                         f"Generated {len(image_paths)} images but expected {len(req.parsed.entities)}"
                     )
 
-                t_images = int((time.time() - t_images_start) * 1000)
+                t_images = (time.perf_counter_ns() - t_images_start) // 1_000_000
 
                 labels_per_entity = generate_labels(
                     req.parsed.entities,
-                    req.profile.labels_languages,
+                    profile_view["labels_languages"],
                 )
 
-                t_render_start = time.time()
-                out_png, out_pdf = render_board(
+                t_render_start = time.perf_counter_ns()
+                # PIL/ReportLab work is CPU-bound; keep it off the event loop
+                out_png, out_pdf = await asyncio.to_thread(
+                    render_board,
                     layout=req.parsed.layout,
                     title=req.title,
                     entities=req.parsed.entities,
@@ -206,8 +224,9 @@ def handle_generate(req: schemas.GenerateRequest, assets_dir: str, job_id: str =
                     labels_per_entity=labels_per_entity,
                     assets_dir=assets_dir,
                     prefix=session_id,
+                    image_bytes=image_bytes,
                 )
-                t_render = int((time.time() - t_render_start) * 1000)
+                t_render = (time.perf_counter_ns() - t_render_start) // 1_000_000
 
                 assets_obj = schemas.Assets(
                     png_url=f"/assets/{out_png}",
@@ -230,35 +249,37 @@ def handle_generate(req: schemas.GenerateRequest, assets_dir: str, job_id: str =
 
             except Exception as err:
                 conversation_logger.record_error(session_id, "image_generation", str(err))
-                logger.warning(
-                    "[orchestrator] Image generation attempt %s failed: %s",
-                    attempt,
-                    err,
-                )
+                logger.warning("Image generation attempt failed", session_id=session_id, attempt=attempt, error=str(err))
 
                 # Clean up partial images
                 for path in image_paths:
                     try:
                         (assets / path).unlink(missing_ok=True)
                     except Exception:
-                        logger.debug("[orchestrator] Failed to cleanup partial image %s", path)
+                        logger.debug("Failed to cleanup partial image", path=path)
 
-                if job_id and job_id in _generation_status:
-                    _generation_status[job_id].message = "הייתה תקלה ביצירת התמונות, מנסה שוב..." if attempt < max_attempts else "הייתה תקלה זמנית ביצירת התמונות." 
+                if job_id:
+                    await progress_store.update(
+                        job_id,
+                        message="הייתה תקלה ביצירת התמונות, מנסה שוב..." if attempt < max_attempts else "הייתה תקלה זמנית ביצירת התמונות.",
+                    )
 
                 if attempt == max_attempts:
-                    logger.exception("[orchestrator] Image generation failed after retries")
+                    logger.exception("Image generation failed after retries", session_id=session_id)
                     conversation_logger.finalize_session(session_id)
-                    if job_id and job_id in _generation_status:
-                        _generation_status[job_id].status = "error"
-                        _generation_status[job_id].message = "יצירת התמונות נכשלה זמנית. נסה שוב בעוד רגע."
+                    if job_id:
+                        await progress_store.update(
+                            job_id,
+                            status="error",
+                            message="יצירת התמונות נכשלה זמנית. נסה שוב בעוד רגע.",
+                        )
                     final_error = RuntimeError("יצירת התמונות נכשלה זמנית. נסה שוב בעוד רגע.")
                     setattr(final_error, "session_id", session_id)
                     setattr(final_error, "session_error_logged", True)
                     raise final_error from err
 
-                time.sleep(1)
-                t_images_start = time.time()
+                await asyncio.sleep(1)
+                t_images_start = time.perf_counter_ns()
                 continue
     except Exception as err:
         if not getattr(err, "session_error_logged", False):
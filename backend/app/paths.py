@@ -0,0 +1,17 @@
+"""
+Filesystem locations shared by the API and the session logger.
+"""
+import os
+from pathlib import Path
+
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+# Assets directory: use Railway volume mount if available, fallback to local
+# Railway volume will be mounted at /app/assets in production
+ASSETS_DIR = Path(os.getenv("ASSETS_PATH", BASE_DIR.parent / "assets"))
+ASSETS_DIR.mkdir(parents=True, exist_ok=True)
+
+# Logs directory for analytics/feedback CSV files
+LOG_DIR = Path(os.getenv("SESSION_LOG_PATH", ASSETS_DIR / "logs"))
+LOG_DIR.mkdir(parents=True, exist_ok=True)
@@ -0,0 +1,122 @@
+"""
+Progress store for background board generation jobs.
+
+When REDIS_URL is set, job progress and results live in Redis so that any
+uvicorn worker can answer status polls for a job started on another worker.
+Without it, an in-process store is used (fine for a single worker / local dev).
+"""
+import json
+import os
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from cachetools import TTLCache
+
+from . import schemas
+from .logger import logger
+
+
+PROGRESS_TTL_SECONDS = int(os.getenv("GENERATION_PROGRESS_TTL_SECONDS", 60 * 60))
+PROGRESS_MAX_JOBS = int(os.getenv("GENERATION_PROGRESS_MAX_JOBS", 2048))
+
+
+@dataclass
+class _JobEntry:
+    progress: schemas.GenerationProgress
+    assets: Optional[schemas.Assets] = None
+
+
+class InMemoryProgressStore:
+    """Job progress kept in this process only, evicted after PROGRESS_TTL_SECONDS"""
+
+    def __init__(self) -> None:
+        # Only touched from the event loop, so no lock is needed
+        self._jobs: TTLCache = TTLCache(maxsize=PROGRESS_MAX_JOBS, ttl=PROGRESS_TTL_SECONDS)
+
+    async def create(self, job_id: str, progress: schemas.GenerationProgress) -> None:
+        self._jobs[job_id] = _JobEntry(progress=progress)
+
+    async def get(self, job_id: str) -> Optional[schemas.GenerationProgress]:
+        entry = self._jobs.get(job_id)
+        return entry.progress if entry else None
+
+    async def update(self, job_id: str, **fields: Any) -> None:
+        entry = self._jobs.get(job_id)
+        if entry is None:
+            return
+        for key, value in fields.items():
+            setattr(entry.progress, key, value)
+
+    async def set_assets(self, job_id: str, assets: schemas.Assets) -> None:
+        entry = self._jobs.get(job_id)
+        if entry is not None:
+            entry.assets = assets
+
+    async def get_assets(self, job_id: str) -> Optional[schemas.Assets]:
+        entry = self._jobs.get(job_id)
+        return entry.assets if entry else None
+
+    async def sweep(self) -> Optional[int]:
+        """Drop expired jobs and return how many are still tracked"""
+        self._jobs.expire()
+        return len(self._jobs)
+
+
+class RedisProgressStore:
+    """Job progress shared across workers via a Redis hash per job"""
+
+    def __init__(self, url: str) -> None:
+        import redis.asyncio as redis
+
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+
+    @staticmethod
+    def _key(job_id: str) -> str:
+        return f"cfi:progress:{job_id}"
+
+    async def create(self, job_id: str, progress: schemas.GenerationProgress) -> None:
+        key = self._key(job_id)
+        mapping = {field: json.dumps(value, ensure_ascii=False) for field, value in progress.model_dump().items()}
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.hset(key, mapping=mapping)
+            pipe.expire(key, PROGRESS_TTL_SECONDS)
+            await pipe.execute()
+
+    async def get(self, job_id: str) -> Optional[schemas.GenerationProgress]:
+        raw = await self._redis.hgetall(self._key(job_id))
+        if not raw:
+            return None
+        raw.pop("assets", None)
+        return schemas.GenerationProgress(**{field: json.loads(value) for field, value in raw.items()})
+
+    async def update(self, job_id: str, **fields: Any) -> None:
+        key = self._key(job_id)
+        # Don't resurrect jobs that already expired
+        if not await self._redis.exists(key):
+            return
+        mapping = {field: json.dumps(value, ensure_ascii=False) for field, value in fields.items()}
+        await self._redis.hset(key, mapping=mapping)
+
+    async def set_assets(self, job_id: str, assets: schemas.Assets) -> None:
+        await self.update(job_id, assets=assets.model_dump())
+
+    async def get_assets(self, job_id: str) -> Optional[schemas.Assets]:
+        raw = await self._redis.hget(self._key(job_id), "assets")
+        if not raw:
+            return None
+        return schemas.Assets(**json.loads(raw))
+
+    async def sweep(self) -> Optional[int]:
+        # Redis expires job keys on its own
+        return None
+
+
+def _create_store():
+    redis_url = os.getenv("REDIS_URL")
+    if redis_url:
+        logger.info("Using Redis for generation progress")
+        return RedisProgressStore(redis_url)
+    return InMemoryProgressStore()
+
+
+progress_store = _create_store()
@@ -1,13 +1,17 @@
+import atexit
 import csv
-import json
 import os
+import queue
 import threading
 from dataclasses import dataclass, field
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
+
+import orjson
 
 from ..logger import logger
+from ..paths import LOG_DIR
 
 
 def _utcnow() -> datetime:
@@ -18,9 +22,9 @@ def _iso(dt: datetime) -> str:
     return dt.astimezone(timezone.utc).isoformat()
 
 
-def _parse_iso(value: Optional[str], fallback: datetime) -> str:
+def _parse_iso(value: Optional[str], fallback_iso: str) -> str:
     if not value:
-        return _iso(fallback)
+        return fallback_iso
     try:
         cleaned = value.strip()
         if cleaned.endswith("Z"):
@@ -30,19 +34,16 @@ def _parse_iso(value: Optional[str], fallback: datetime) -> str:
             parsed = parsed.replace(tzinfo=timezone.utc)
         return _iso(parsed)
     except Exception:
-        return _iso(fallback)
-
+        return fallback_iso
 
-BASE_DIR = Path(__file__).resolve().parent.parent
-ASSETS_ROOT = Path(os.getenv("ASSETS_PATH", BASE_DIR.parent / "assets"))
-LOG_DIR = Path(os.getenv("SESSION_LOG_PATH", ASSETS_ROOT / "logs"))
-LOG_DIR.mkdir(parents=True, exist_ok=True)
 
 KPI_FILE = LOG_DIR / "conversation_kpis.csv"
 DETAIL_FILE = LOG_DIR / "conversation_details.ndjson"
 FEEDBACK_FILE = LOG_DIR / "user_feedback.csv"
 
 MAX_BYTES = int(os.getenv("SESSION_LOG_MAX_BYTES", 50 * 1024 * 1024))
+# Max queued log entries the writer thread drains per wake-up
+WRITE_BATCH_SIZE = 64
 EXPIRE_SECONDS = int(os.getenv("SESSION_LOG_IDLE_FLUSH_SECONDS", 30 * 60))
 
 FEEDBACK_HEADERS = ["timestamp", "session_id", "rating", "comment"]
@@ -79,45 +80,183 @@ class SessionData:
     errors: List[Dict[str, Any]] = field(default_factory=list)
 
 
-_lock = threading.Lock()
-_sessions: Dict[str, SessionData] = {}
+_SHARD_COUNT = 16
+# Striped locks: each session lives in one shard, so unrelated sessions don't contend.
+# record_* never await and never touch disk (writes go through _LogWriter), so a shard
+# lock is only held for a few dict/list operations; no per-session asyncio.Lock needed.
+_SHARDS: List[Tuple[threading.Lock, Dict[str, SessionData]]] = [
+    (threading.Lock(), {}) for _ in range(_SHARD_COUNT)
+]
+
+
+def _shard(session_id: str) -> Tuple[threading.Lock, Dict[str, SessionData]]:
+    return _SHARDS[hash(session_id) % _SHARD_COUNT]
+
+
+def _ndjson_line(entry: Dict[str, Any]) -> bytes:
+    # Emits UTF-8 bytes directly, which is what ensure_ascii=False was after
+    return orjson.dumps(entry, option=orjson.OPT_APPEND_NEWLINE | orjson.OPT_NON_STR_KEYS)
 
 
 def _maybe_rotate(path: Path) -> bool:
-    if path.exists() and path.stat().st_size >= MAX_BYTES:
+    """Drop the log once it outgrows MAX_BYTES; True when the file must be started afresh"""
+    # A single stat answers both "does it exist" and "how big is it"
+    try:
+        size = path.stat().st_size
+    except FileNotFoundError:
+        return True
+    if size >= MAX_BYTES:
         path.unlink()
         return True
-    return not path.exists() or path.stat().st_size == 0
+    return size == 0
+
+
+class _AppendLog:
+    """
+    One append-only log file, kept open by the writer thread between batches.
+    CSV logs reuse a single DictWriter; logs without headers are NDJSON.
+    """
+
+    def __init__(self, path: Path, headers: Optional[List[str]] = None) -> None:
+        self.path = path
+        self.headers = headers
+        self._fp = None
+        self._csv: Optional[csv.DictWriter] = None
+
+    def prepare(self) -> None:
+        """Called once per batch: reopen after rotation or if the file went away"""
+        needs_header = _maybe_rotate(self.path)
+        if self._fp is not None and not needs_header:
+            return
+        self.close()
+        if self.headers:
+            self._fp = self.path.open("a", newline="", encoding="utf-8")
+            self._csv = csv.DictWriter(self._fp, fieldnames=self.headers)
+            if needs_header:
+                self._csv.writeheader()
+        else:
+            self._fp = self.path.open("ab")
+
+    def write(self, record: Dict[str, Any]) -> None:
+        if self._csv is not None:
+            self._csv.writerow(record)
+        else:
+            self._fp.write(_ndjson_line(record))
+
+    def flush(self) -> None:
+        if self._fp is not None:
+            self._fp.flush()
+
+    def close(self) -> None:
+        if self._fp is not None:
+            self._fp.close()
+        self._fp = None
+        self._csv = None
+
+
+class _LogWriter(threading.Thread):
+    """
+    Single consumer for all log-file appends, so request handlers only enqueue
+    and never wait on disk. Being the only writer, it needs no file lock.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(name="conversation-log-writer", daemon=True)
+        self._queue: "queue.Queue[Optional[Tuple[str, Dict[str, Any]]]]" = queue.Queue()
+        self._logs: Dict[str, _AppendLog] = {
+            "csv": _AppendLog(KPI_FILE, CSV_HEADERS),
+            "ndjson": _AppendLog(DETAIL_FILE),
+            "feedback": _AppendLog(FEEDBACK_FILE, FEEDBACK_HEADERS),
+        }
+
+    def enqueue(self, kind: str, payload: Dict[str, Any]) -> None:
+        self._queue.put((kind, payload))
+
+    def flush(self) -> None:
+        """Block until everything enqueued so far is on disk"""
+        self._queue.join()
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self.join(timeout=5)
+
+    def _write_batch(self, batch: List[Tuple[str, Dict[str, Any]]]) -> None:
+        touched: Dict[str, _AppendLog] = {}
+        for kind, payload in batch:
+            log = self._logs[kind]
+            try:
+                if kind not in touched:
+                    log.prepare()
+                    touched[kind] = log
+                log.write(payload)
+            except Exception as exc:
+                logger.error("Failed to write conversation log", kind=kind, error=str(exc))
+                log.close()
+                # Reopen for the next entry of this kind rather than writing to the closed file
+                touched.pop(kind, None)
+
+        # One flush per file per batch instead of one open/close per row
+        for kind, log in touched.items():
+            try:
+                log.flush()
+            except Exception as exc:
+                logger.error("Failed to flush conversation log", kind=kind, error=str(exc))
+                log.close()
+
+    def run(self) -> None:
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            while len(batch) < WRITE_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stopping = None in batch
+            self._write_batch([item for item in batch if item is not None])
+            for _ in batch:
+                self._queue.task_done()
+
+        for log in self._logs.values():
+            log.close()
+
+
+_writer = _LogWriter()
+_writer.start()
+# Drain whatever is still queued when the process exits
+atexit.register(_writer.close)
 
 
 def _write_csv_row(row: Dict[str, Any]) -> None:
-    needs_header = _maybe_rotate(KPI_FILE)
-    with KPI_FILE.open("a", newline="", encoding="utf-8") as fp:
-        writer = csv.DictWriter(fp, fieldnames=CSV_HEADERS)
-        if needs_header:
-            writer.writeheader()
-        writer.writerow(row)
+    _writer.enqueue("csv", row)
 
 
 def _write_ndjson(entry: Dict[str, Any]) -> None:
-    _maybe_rotate(DETAIL_FILE)
-    with DETAIL_FILE.open("a", encoding="utf-8") as fp:
-        fp.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    _writer.enqueue("ndjson", entry)
+
+
+def flush() -> None:
+    """Wait for pending log writes, e.g. before reading the log files back"""
+    _writer.flush()
 
 
 def _collect_expired(now: datetime) -> List[SessionData]:
+    # Takes each shard lock in turn; never call this while holding one
     expired: List[SessionData] = []
-    for session_id, data in list(_sessions.items()):
-        if (now - data.updated_at).total_seconds() >= EXPIRE_SECONDS:
-            expired.append(_sessions.pop(session_id))
+    for lock, sessions in _SHARDS:
+        with lock:
+            for session_id, data in list(sessions.items()):
+                if (now - data.updated_at).total_seconds() >= EXPIRE_SECONDS:
+                    expired.append(sessions.pop(session_id))
     return expired
 
 
-def _append_history(session: SessionData, history: List[Dict[str, Any]], fallback: datetime) -> None:
+def _append_history(session: SessionData, history: List[Dict[str, Any]], fallback_iso: str) -> None:
     for item in history:
         role = item.get("role", "unknown")
         text = item.get("text", "")
-        timestamp = _parse_iso(item.get("timestamp"), fallback)
+        timestamp = _parse_iso(item.get("timestamp"), fallback_iso)
         session.conversation.append(
             {
                 "timestamp": timestamp,
@@ -130,11 +269,13 @@ def _append_history(session: SessionData, history: List[Dict[str, Any]], fallbac
 
 def _export(session: SessionData, ended_at: datetime) -> Dict[str, Dict[str, Any]]:
     duration = max((ended_at - session.created_at).total_seconds(), 0.0)
+    started_iso = _iso(session.created_at)
+    ended_iso = _iso(ended_at)
     csv_row = {
         "session_id": session.session_id,
         "user_name": session.user_name or "",
-        "started_at": _iso(session.created_at),
-        "ended_at": _iso(ended_at),
+        "started_at": started_iso,
+        "ended_at": ended_iso,
         "session_duration_seconds": f"{duration:.2f}",
         "total_requests": session.total_requests,
         "first_prompt": session.first_prompt or "",
@@ -146,8 +287,8 @@ def _export(session: SessionData, ended_at: datetime) -> Dict[str, Dict[str, Any
     ndjson_entry = {
         "session_id": session.session_id,
         "user_name": session.user_name,
-        "started_at": _iso(session.created_at),
-        "ended_at": _iso(ended_at),
+        "started_at": started_iso,
+        "ended_at": ended_iso,
         "duration_seconds": duration,
         "total_requests": session.total_requests,
         "first_prompt": session.first_prompt,
@@ -169,10 +310,11 @@ def record_preview_request(
     conversation_history: List[Dict[str, Any]],
 ) -> None:
     now = _utcnow()
-    expired: List[SessionData] = []
-    with _lock:
-        expired = _collect_expired(now)
-        session = _sessions.get(session_id)
+    now_iso = _iso(now)
+    expired = _collect_expired(now)
+    lock, sessions = _shard(session_id)
+    with lock:
+        session = sessions.get(session_id)
         if session is None:
             session = SessionData(
                 session_id=session_id,
@@ -180,9 +322,9 @@ def record_preview_request(
                 created_at=now,
                 updated_at=now,
             )
-            _sessions[session_id] = session
+            sessions[session_id] = session
             if conversation_history:
-                _append_history(session, conversation_history, now)
+                _append_history(session, conversation_history, now_iso)
         else:
             session.updated_at = now
             if user_name and not session.user_name:
@@ -194,7 +336,7 @@ def record_preview_request(
 
         session.conversation.append(
             {
-                "timestamp": _iso(now),
+                "timestamp": now_iso,
                 "role": "user",
                 "text": board_description,
                 "source": "user_request",
@@ -211,8 +353,10 @@ def record_preview_result(
     llm_payload: Dict[str, Any],
 ) -> None:
     now = _utcnow()
-    with _lock:
-        session = _sessions.get(session_id)
+    now_iso = _iso(now)
+    lock, sessions = _shard(session_id)
+    with lock:
+        session = sessions.get(session_id)
         if session is None:
             return
         session.updated_at = now
@@ -220,7 +364,7 @@ def record_preview_result(
             session.summary = summary
         session.conversation.append(
             {
-                "timestamp": _iso(now),
+                "timestamp": now_iso,
                 "role": "agent",
                 "text": summary or "",
                 "source": "preview_response",
@@ -231,8 +375,10 @@ def record_preview_result(
 
 def record_generate_start(session_id: str, image_count: int) -> None:
     now = _utcnow()
-    with _lock:
-        session = _sessions.get(session_id)
+    now_iso = _iso(now)
+    lock, sessions = _shard(session_id)
+    with lock:
+        session = sessions.get(session_id)
         if session is None:
             session = SessionData(
                 session_id=session_id,
@@ -240,12 +386,12 @@ def record_generate_start(session_id: str, image_count: int) -> None:
                 created_at=now,
                 updated_at=now,
             )
-            _sessions[session_id] = session
+            sessions[session_id] = session
         session.updated_at = now
         session.images_requested = max(session.images_requested, image_count)
         session.conversation.append(
             {
-                "timestamp": _iso(now),
+                "timestamp": now_iso,
                 "role": "system",
                 "text": f"generation_started ({image_count})",
                 "source": "generation_start",
@@ -261,8 +407,10 @@ def record_generate_success(
     board_pdf: str,
 ) -> None:
     now = _utcnow()
-    with _lock:
-        session = _sessions.get(session_id)
+    now_iso = _iso(now)
+    lock, sessions = _shard(session_id)
+    with lock:
+        session = sessions.get(session_id)
         if session is None:
             session = SessionData(
                 session_id=session_id,
@@ -270,7 +418,7 @@ def record_generate_success(
                 created_at=now,
                 updated_at=now,
             )
-            _sessions[session_id] = session
+            sessions[session_id] = session
         session.updated_at = now
         session.images_created = len(image_files)
         session.assets = {
@@ -280,7 +428,7 @@ def record_generate_success(
         }
         session.conversation.append(
             {
-                "timestamp": _iso(now),
+                "timestamp": now_iso,
                 "role": "system",
                 "text": "generation_completed",
                 "source": "generation_complete",
@@ -291,8 +439,10 @@ def record_generate_success(
 
 def record_error(session_id: str, stage: str, message: str) -> None:
     now = _utcnow()
-    with _lock:
-        session = _sessions.get(session_id)
+    now_iso = _iso(now)
+    lock, sessions = _shard(session_id)
+    with lock:
+        session = sessions.get(session_id)
         if session is None:
             session = SessionData(
                 session_id=session_id,
@@ -300,18 +450,18 @@ def record_error(session_id: str, stage: str, message: str) -> None:
                 created_at=now,
                 updated_at=now,
             )
-            _sessions[session_id] = session
+            sessions[session_id] = session
         session.updated_at = now
         session.had_error = True
         error_entry = {
-            "timestamp": _iso(now),
+            "timestamp": now_iso,
             "stage": stage,
             "message": message,
         }
         session.errors.append(error_entry)
         session.conversation.append(
             {
-                "timestamp": _iso(now),
+                "timestamp": now_iso,
                 "role": "system",
                 "text": f"error: {message}",
                 "source": "error",
@@ -328,8 +478,9 @@ def write_session(session: SessionData, now: Optional[datetime] = None) -> None:
 
 
 def finalize_session(session_id: str) -> None:
-    with _lock:
-        session = _sessions.pop(session_id, None)
+    lock, sessions = _shard(session_id)
+    with lock:
+        session = sessions.pop(session_id, None)
     if session:
         write_session(session)
 
@@ -340,31 +491,21 @@ def record_feedback(session_id: str, rating: int, comment: Optional[str]) -> Non
     This can be called even after session is finalized.
     """
     now = _utcnow()
-    
-    # Rotate feedback file if needed
-    _maybe_rotate(FEEDBACK_FILE)
-    
-    # Write to feedback CSV
+    now_iso = _iso(now)
+
     feedback_row = {
-        "timestamp": _iso(now),
+        "timestamp": now_iso,
         "session_id": session_id,
         "rating": rating,
         "comment": comment or "",
     }
-    
-    with _lock:
-        file_exists = FEEDBACK_FILE.exists()
-        with open(FEEDBACK_FILE, "a", newline="", encoding="utf-8") as f:
-            writer = csv.DictWriter(f, fieldnames=FEEDBACK_HEADERS)
-            if not file_exists:
-                writer.writeheader()
-            writer.writerow(feedback_row)
+    _writer.enqueue("feedback", feedback_row)
     
     logger.info("Feedback recorded", session_id=session_id, rating=rating)
     
     # Also append to NDJSON detail log for completeness
     detail_entry = {
-        "timestamp": _iso(now),
+        "timestamp": now_iso,
         "session_id": session_id,
         "event": "user_feedback",
         "data": {"rating": rating, "comment": comment},
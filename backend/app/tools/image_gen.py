@@ -1,14 +1,37 @@
+import asyncio
+import functools
 import os
-import uuid
 import base64
+import random
+import re
 from pathlib import Path
-from typing import List, Dict, Optional
+from secrets import token_hex
+from typing import TYPE_CHECKING, Awaitable, Callable, List, Dict, Optional
 from PIL import Image, ImageDraw, ImageFont
-from google import genai
+import httpx
 
 from ..logger import logger
 
+if TYPE_CHECKING:
+    # The SDK is slow to import, so it's only loaded once an image is actually requested
+    from google import genai
 
+
+# Max in-flight Gemini requests per board, to stay under rate limits
+GEMINI_CONCURRENCY = int(os.getenv("GEMINI_CONCURRENCY", 4))
+# Attempts per image for timeouts, 429s and 5xx; the delay doubles from GEMINI_RETRY_BASE_SECONDS
+GEMINI_MAX_ATTEMPTS = int(os.getenv("GEMINI_MAX_ATTEMPTS", 3))
+GEMINI_RETRY_BASE_SECONDS = float(os.getenv("GEMINI_RETRY_BASE_SECONDS", 2.0))
+GEMINI_RETRY_MAX_DELAY = 30.0
+
+_RETRYABLE_STATUS = frozenset({408, 429, 500, 502, 503, 504})
+_PNG_MAGIC = b"\x89PNG\r\n\x1a\n"
+_JPEG_MAGIC = b"\xff\xd8\xff"
+# Anything that isn't safe in an asset filename
+_UNSAFE_PREFIX_CHARS = re.compile(r"[^A-Za-z0-9_-]+")
+
+
+@functools.lru_cache(maxsize=8)
 def _safe_font(size: int) -> ImageFont.FreeTypeFont | ImageFont.ImageFont:
     try:
         return ImageFont.truetype("DejaVuSans.ttf", size)
@@ -19,102 +42,194 @@ def _safe_font(size: int) -> ImageFont.FreeTypeFont | ImageFont.ImageFont:
 def _sanitize_prefix(prefix: Optional[str]) -> str:
     if not prefix:
         return ""
-    safe = "".join(ch for ch in str(prefix) if ch.isalnum() or ch in {"-", "_"})
+    safe = _UNSAFE_PREFIX_CHARS.sub("", str(prefix))
     if safe and not safe.endswith("_"):
         safe = f"{safe}_"
     return safe
 
 
+@functools.lru_cache(maxsize=1)
+def _placeholder_template() -> Image.Image:
+    """Blank framed canvas; callers draw on a copy"""
+    img = Image.new("RGB", (512, 512), color=(255, 255, 255))
+    ImageDraw.Draw(img).rectangle([10, 10, 502, 502], outline=(30, 30, 30), width=4)
+    return img
+
+
 def _generate_placeholder(entity: str, assets: Path, prefix: Optional[str] = None) -> str:
     """Fallback placeholder image"""
-    img = Image.new("RGB", (512, 512), color=(255, 255, 255))
+    img = _placeholder_template().copy()
     draw = ImageDraw.Draw(img)
     font = _safe_font(28)
 
     text = str(entity)
     bbox = draw.textbbox((0, 0), text, font=font)
     tw, th = bbox[2] - bbox[0], bbox[3] - bbox[1]
-    draw.rectangle([10, 10, 502, 502], outline=(30, 30, 30), width=4)
     draw.text(((512 - tw) / 2, (512 - th) / 2), text, fill=(20, 20, 20), font=font, align="center")
 
-    filename = f"{_sanitize_prefix(prefix)}img_{uuid.uuid4().hex[:8]}.png"
-    img.save(assets / filename)
+    filename = f"{_sanitize_prefix(prefix)}img_{token_hex(4)}.png"
+    # Mostly-white canvas: fast zlib compresses it about as well as the default level
+    img.save(assets / filename, format="PNG", compress_level=1, optimize=False)
     return filename
 
 
-def _generate_with_gemini(entity: str, prompt_text: str, assets: Path, prefix: Optional[str] = None) -> str | None:
-    """Try Gemini image generation"""
-    api_key = os.getenv("GOOGLE_GENAI_API_KEY")
-    if not api_key:
-        logger.warning("No Gemini API key found", entity=entity)
+@functools.lru_cache(maxsize=1)
+def _genai_client(api_key: str) -> "genai.Client":
+    # Shared by every image request so they reuse one connection pool
+    from google import genai
+
+    return genai.Client(api_key=api_key)
+
+
+def _backoff(attempt: int) -> float:
+    return min(GEMINI_RETRY_BASE_SECONDS * 2 ** (attempt - 1) + random.uniform(0, 1), GEMINI_RETRY_MAX_DELAY)
+
+
+def _retry_delay(exc: Exception, attempt: int) -> Optional[float]:
+    """Seconds to wait before retrying a failed Gemini call, or None if it isn't transient"""
+    from google.genai import errors as genai_errors
+
+    if isinstance(exc, genai_errors.APIError):
+        # Auth / bad request errors won't get better on retry
+        if exc.code not in _RETRYABLE_STATUS:
+            return None
+        headers = getattr(exc.response, "headers", None) or {}
+        retry_after = headers.get("retry-after")
+        if retry_after:
+            try:
+                return min(float(retry_after), GEMINI_RETRY_MAX_DELAY)
+            except ValueError:
+                pass
+    elif not isinstance(exc, (httpx.TransportError, asyncio.TimeoutError)):
         return None
+    return _backoff(attempt)
 
-    try:
-        logger.info("Generating image with Gemini", entity=entity, prompt_preview=prompt_text[:100])
-        client = genai.Client(api_key=api_key)
-        response = client.models.generate_content(
-            model="gemini-2.5-flash-image",
-            contents=[{"role": "user", "parts": [{"text": prompt_text}]}],
-        )
-
-        logger.debug("Gemini response received", response_type=str(type(response)))
+
+def _is_image(data: bytes) -> bool:
+    return data.startswith(_PNG_MAGIC) or data.startswith(_JPEG_MAGIC)
+
+
+async def _request_image(client: "genai.Client", entity: str, prompt_text: str) -> bytes | None:
+    """One Gemini call; returns the image bytes, or None when the response holds no image"""
+    response = await client.aio.models.generate_content(
+        model="gemini-2.5-flash-image",
+        contents=[{"role": "user", "parts": [{"text": prompt_text}]}],
+    )
+
+    # Check for safety filter blocks
+    if response and response.candidates:
+        candidate = response.candidates[0]
         
-        # Check for safety filter blocks
-        if response and response.candidates:
-            candidate = response.candidates[0]
-            
-            # Log finish reason for debugging
-            if hasattr(candidate, 'finish_reason'):
-                logger.debug("Candidate finish reason", finish_reason=str(candidate.finish_reason), entity=entity)
-                # If blocked by safety filters, log it clearly
-                if 'SAFETY' in str(candidate.finish_reason):
-                    logger.warning("Content blocked by safety filters", entity=entity, finish_reason=str(candidate.finish_reason))
-                    return None
-            
-            logger.debug("Processing candidates", candidate_count=len(response.candidates))
-            logger.debug("Candidate parts", parts_count=len(candidate.content.parts))
-            
-            for i, part in enumerate(candidate.content.parts):
-                if hasattr(part, "inline_data") and part.inline_data and part.inline_data.data:
-                    # Check if data is already bytes or needs decoding
-                    raw_data = part.inline_data.data
-                    logger.debug("Image data found", data_type=str(type(raw_data)))
-                    
-                    if isinstance(raw_data, bytes):
-                        img_data = raw_data
-                    else:
-                        img_data = base64.b64decode(raw_data)
-                    
-                    filename = f"{_sanitize_prefix(prefix)}img_{uuid.uuid4().hex[:8]}.png"
-                    with open(assets / filename, "wb") as f:
-                        f.write(img_data)
-                    logger.success("Image generated successfully", entity=entity, filename=filename, size_bytes=len(img_data))
-                    return filename
-                    
-        logger.warning("No image data in Gemini response", entity=entity)
-        return None
-    except Exception as e:
-        logger.error("Gemini image generation failed", entity=entity, error=str(e), exc_info=True)
+        # Log finish reason for debugging
+        if hasattr(candidate, 'finish_reason'):
+            logger.debug("Candidate finish reason", finish_reason=str(candidate.finish_reason), entity=entity)
+            # If blocked by safety filters, log it clearly
+            if 'SAFETY' in str(candidate.finish_reason):
+                logger.warning("Content blocked by safety filters", entity=entity, finish_reason=str(candidate.finish_reason))
+                return None
+        
+        logger.debug("Processing candidates", candidate_count=len(response.candidates))
+        logger.debug("Candidate parts", parts_count=len(candidate.content.parts))
+        
+        # First part carrying image data wins
+        for part in candidate.content.parts:
+            inline = getattr(part, "inline_data", None)
+            if inline and inline.data:
+                raw_data = inline.data
+                # The SDK normally hands back bytes; older responses carry base64 text
+                return raw_data if isinstance(raw_data, (bytes, bytearray)) else base64.b64decode(raw_data)
+                
+    logger.warning("No image data in Gemini response", entity=entity)
+    return None
+
+
+async def _generate_with_gemini(
+    entity: str,
+    prompt_text: str,
+    assets: Path,
+    prefix: Optional[str] = None,
+    image_bytes: Optional[Dict[str, bytes]] = None,
+) -> str | None:
+    """Try Gemini image generation, retrying transient failures with exponential backoff"""
+    api_key = os.getenv("GOOGLE_GENAI_API_KEY")
+    if not api_key:
+        logger.warning("No Gemini API key found", entity=entity)
         return None
 
-
-def generate_images(prompts: List[Dict], assets_dir: str, prefix: Optional[str] = None) -> List[str]:
-    out_paths: List[str] = []
+    logger.info("Generating image with Gemini", entity=entity, prompt_preview=prompt_text[:100])
+    client = _genai_client(api_key)
+
+    for attempt in range(1, GEMINI_MAX_ATTEMPTS + 1):
+        try:
+            img_data = await _request_image(client, entity, prompt_text)
+        except Exception as e:
+            delay = _retry_delay(e, attempt)
+            if delay is None or attempt == GEMINI_MAX_ATTEMPTS:
+                logger.error("Gemini image generation failed", entity=entity, attempt=attempt, error=str(e), exc_info=True)
+                return None
+            logger.warning("Gemini request failed, retrying", entity=entity, attempt=attempt, delay=round(delay, 2), error=str(e))
+            await asyncio.sleep(delay)
+            continue
+
+        if img_data is None:
+            # Safety block or no image part: a retry would just get the same answer
+            return None
+        if not _is_image(img_data):
+            if attempt == GEMINI_MAX_ATTEMPTS:
+                logger.error("Gemini returned invalid image data", entity=entity, attempt=attempt, size_bytes=len(img_data))
+                return None
+            logger.warning("Gemini returned invalid image data, retrying", entity=entity, attempt=attempt, size_bytes=len(img_data))
+            await asyncio.sleep(_backoff(attempt))
+            continue
+
+        filename = f"{_sanitize_prefix(prefix)}img_{token_hex(4)}.png"
+        # Write off the event loop so other boards' requests keep flowing meanwhile
+        await asyncio.to_thread((assets / filename).write_bytes, img_data)
+        if image_bytes is not None:
+            image_bytes[filename] = img_data
+        logger.success("Image generated successfully", entity=entity, filename=filename, size_bytes=len(img_data))
+        return filename
+
+    return None
+
+
+async def generate_images(
+    prompts: List[Dict],
+    assets_dir: str,
+    prefix: Optional[str] = None,
+    on_complete: Optional[Callable[[str, str], Awaitable[None]]] = None,
+    image_bytes: Optional[Dict[str, bytes]] = None,
+) -> List[str]:
+    """
+    Generate one image per prompt concurrently; results keep the order of `prompts`.
+    `on_complete(entity, filename)` is awaited as each image finishes, in completion order.
+    If `image_bytes` is given, Gemini images are also kept there by filename so the
+    renderer can decode them without reading the files back.
+    """
     assets = Path(assets_dir)
     assets.mkdir(parents=True, exist_ok=True)
+    semaphore = asyncio.Semaphore(GEMINI_CONCURRENCY)
 
-    for item in prompts:
+    async def _generate_one(item: Dict) -> str:
         entity = item.get("entity", "item")
         prompt_text = item.get("prompt", entity)
 
         # Try Gemini first
-        filename = _generate_with_gemini(entity, prompt_text, assets, prefix=prefix)
+        async with semaphore:
+            filename = await _generate_with_gemini(entity, prompt_text, assets, prefix=prefix, image_bytes=image_bytes)
         if not filename:
             # Fallback to placeholder
-            filename = _generate_placeholder(entity, assets, prefix=prefix)
-
-        out_paths.append(filename)
-
-    return out_paths
+            filename = await asyncio.to_thread(_generate_placeholder, entity, assets, prefix=prefix)
+        if on_complete is not None:
+            await on_complete(entity, filename)
+        return filename
+
+    # Let every task settle before surfacing a failure, so no image is still being
+    # written while the caller cleans up the ones that finished
+    results = await asyncio.gather(*(_generate_one(item) for item in prompts), return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
 
 
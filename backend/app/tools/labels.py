@@ -1,3 +1,4 @@
+from functools import lru_cache
 from typing import Dict, List
 
 # Simple translation dictionary for common terms (Hebrew to other languages)
@@ -32,27 +33,25 @@ TRANSLATIONS = {
 }
 
 
+# Flattened at import: target language -> normalized Hebrew term -> translation
+_FLAT: Dict[str, Dict[str, str]] = {}
+for _term, _targets in TRANSLATIONS["hebrew"].items():
+    for _lang, _value in _targets.items():
+        _FLAT.setdefault(_lang, {})[_term.strip().lower()] = _value
+_NO_TRANSLATIONS: Dict[str, str] = {}
+
+
+@lru_cache(maxsize=1024)
 def _translate(text: str, target_lang: str) -> str:
     """Simple lookup translation from Hebrew to target language"""
-    text_lower = text.strip().lower()
-    he_dict = TRANSLATIONS.get("hebrew", {})
-    if text_lower in he_dict:
-        mapping = he_dict[text_lower]
-        return mapping.get(target_lang, text)
-    return text
+    return _FLAT.get(target_lang, _NO_TRANSLATIONS).get(text.strip().lower(), text)
 
 
 def generate_labels(entities: List[str], languages: List[str]) -> List[Dict[str, str]]:
     """Generate labels in multiple languages for each entity"""
-    out: List[Dict[str, str]] = []
-    for entity in entities:
-        entry: Dict[str, str] = {}
-        for lang in languages:
-            if lang.lower() in ("hebrew", "he"):
-                entry[lang] = entity
-            else:
-                entry[lang] = _translate(entity, lang.lower())
-        out.append(entry)
-    return out
-
-
+    # Resolve each language once rather than once per entity
+    lang_meta = [(lang, lang.lower() in ("hebrew", "he"), lang.lower()) for lang in languages]
+    return [
+        {lang: entity if is_hebrew else _translate(entity, lowered) for lang, is_hebrew, lowered in lang_meta}
+        for entity in entities
+    ]
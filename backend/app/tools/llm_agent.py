@@ -1,10 +1,18 @@
+import asyncio
+import functools
 import os
-import json
-from typing import Dict, Any, List
-from openai import OpenAI
+from typing import TYPE_CHECKING, Dict, Any, List, Mapping
 from pydantic import BaseModel, Field
 
+import orjson
+
 from ..logger import logger
+from .llm_cache import cached
+from ..schemas import PatientProfile
+
+if TYPE_CHECKING:
+    # The SDK is slow to import, so it's only loaded with the first LLM call
+    from openai import AsyncOpenAI
 
 
 # Pydantic models for structured image prompt generation
@@ -17,21 +25,20 @@ class ImagePromptsResponse(BaseModel):
     prompts: List[ImagePrompt] = Field(..., description="List of image generation prompts, one per entity")
 
 
-def _get_client():
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        raise ValueError("OPENAI_API_KEY not set")
-    return OpenAI(api_key=api_key)
+# Model settings are part of the cache key, so changing them invalidates cached answers
+PLAN_MODEL = "gpt-4o"
+PLAN_TEMPERATURE = 0.3
+PROMPTS_MODEL = "gpt-4o"
+PROMPTS_TEMPERATURE = 0.7
 
+# Entities per prompt-building call (the largest layout, 3x3, still fits in one) and how
+# many such calls may be in flight at once, to stay under the OpenAI rate limit
+PROMPT_CHUNK_SIZE = 9
+_prompt_slots = asyncio.Semaphore(4)
 
-def understand_request(board_description: str, patient_profile: Dict, conversation_history: str = "") -> Dict[str, Any]:
-    """
-    Use LLM to understand user intent and extract structured plan.
-    Returns either a plan or questions for clarification.
-    """
-    client = _get_client()
-    
-    system_prompt = """You are an assistant helping speech therapists create communication boards.
+
+# System prompts live at module level so they aren't rebuilt per call; the image one is filled in per board
+_PLAN_SYSTEM_PROMPT = """You are an assistant helping speech therapists create communication boards.
 Your job is to understand what board the user wants to create.
 
 IMPORTANT: Respond in the SAME LANGUAGE as the user's input (Hebrew/English/Arabic).
@@ -117,14 +124,72 @@ Examples:
   → reasoning: "הבנתי, אני אצור לך לוח 3x3 עם הפריטים הבאים:\n- פעלים (3): לאכול, לשתות, לרצות\n- תארים (3): חם, קר, טוב\n- שמות גוף (3): אני, אתה, הוא\n\nהאם להתחיל ביצירת הלוח?"
 """
 
+_IMAGE_PROMPTS_SYSTEM_TEMPLATE = """You are an expert at creating image generation prompts for communication boards.
+{profile_section}
+- Style needed: {image_style}
+- Board context: {board_context}
+
+CRITICAL: Images must be CONTEXTUAL to the board topic AND culturally appropriate!
+
+For abstract concepts (verbs, adjectives, pronouns), show them IN CONTEXT:
+- If board is about breakfast:
+  - "hot" → hot coffee or hot food, NOT the sun
+  - "cold" → cold milk or cold juice, NOT ice
+  - "eat" → person eating breakfast, NOT generic eating
+  - "drink" → person drinking from cup, NOT water bottle
+  - "I/you/he" → person at breakfast table in relevant pose
+
+SPECIAL HANDLING FOR EMOTIONAL CONCEPTS (to avoid AI safety filters):
+- "love" / "אהבה" → Show WHOLESOME family affection: parent hugging child, family holding hands, or heart-shaped object (like a heart-shaped cushion or drawing). NEVER romantic love. Use phrases like "parent lovingly hugging young child" or "family showing affection with a hug"
+- "friendship" / "חברות" → Children playing together, sharing toys, or holding hands while playing
+- "happiness" / "שמחה" → Smiling child with arms raised in joy, or child laughing while playing
+- "care" / "דאגה" → Parent gently tending to child (e.g., bandaging knee, comforting)
+These concepts MUST be depicted in INNOCENT, WHOLESOME, FAMILY-APPROPRIATE ways that clearly pass content safety filters.
+
+For each entity, create a detailed prompt optimized for Google's Gemini image generation that:
+- Describes a single, clear scene or object on white background
+- Uses {image_style} style (realistic/explicit if patient can't read; clean/friendly otherwise)
+- Is age-appropriate for {age} year old
+- No text, logos, or watermarks in image
+- Explicit, recognizable representation (not icons or symbols)
+- ALWAYS relates abstract concepts to the board's context (breakfast, emotions, etc.)
+- If the image is related to a known public figure, use comics style in the prompt and the image should be a cartoon.
+
+You must return a list of prompts, one for each entity provided.
+"""
+
+
+@functools.lru_cache(maxsize=1)
+def _client_for(api_key: str) -> "AsyncOpenAI":
+    # One client per process so calls share its keep-alive connection pool
+    from openai import AsyncOpenAI
+
+    return AsyncOpenAI(api_key=api_key)
+
+
+def _get_client():
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY not set")
+    return _client_for(api_key)
+
+
+@cached(ttl=3600, model=PLAN_MODEL, temperature=PLAN_TEMPERATURE)
+async def understand_request(board_description: str, patient_profile: PatientProfile, conversation_history: str = "") -> Dict[str, Any]:
+    """
+    Use LLM to understand user intent and extract structured plan.
+    Returns either a plan or questions for clarification.
+    """
+    client = _get_client()
+    
     # Check if patient profile has any meaningful data
-    has_profile = patient_profile and any(
-        patient_profile.get(k) is not None 
+    has_profile = patient_profile is not None and any(
+        getattr(patient_profile, k) is not None
         for k in ['age', 'gender', 'language', 'can_read', 'religion', 'sector']
     )
     
     if has_profile:
-        user_msg = f"""Patient profile: {json.dumps(patient_profile, ensure_ascii=False)}
+        user_msg = f"""Patient profile: {patient_profile.model_dump_json()}
 
 Conversation history:
 {conversation_history}
@@ -142,21 +207,23 @@ Note: No patient profile provided. Create board with default settings.
 
 Provide your analysis as JSON."""
 
-    response = client.chat.completions.create(
-        model="gpt-4o",
+    response = await client.chat.completions.create(
+        model=PLAN_MODEL,
         messages=[
-            {"role": "system", "content": system_prompt},
+            {"role": "system", "content": _PLAN_SYSTEM_PROMPT},
             {"role": "user", "content": user_msg}
         ],
         response_format={"type": "json_object"},
-        temperature=0.3,
+        temperature=PLAN_TEMPERATURE,
     )
     
-    result = json.loads(response.choices[0].message.content)
+    content = response.choices[0].message.content
+    result = orjson.loads(content)
     return result
 
 
-def build_image_prompts(entities: List[str], patient_profile: Dict, image_style: str, board_context: str = "") -> List[Dict[str, str]]:
+@cached(ttl=3600, model=PROMPTS_MODEL, temperature=PROMPTS_TEMPERATURE)
+async def build_image_prompts(entities: List[str], patient_profile: Mapping[str, Any], image_style: str, board_context: str = "") -> List[Dict[str, str]]:
     """
     Use LLM to create detailed, context-aware prompts for image generation.
     """
@@ -241,41 +308,12 @@ CRITICAL CULTURAL SENSITIVITY:
         # No profile provided - don't mention patient context at all
         profile_section = ""
     
-    system_prompt = f"""You are an expert at creating image generation prompts for communication boards.
-{profile_section}
-- Style needed: {image_style}
-- Board context: {board_context if board_context else "general"}
-
-CRITICAL: Images must be CONTEXTUAL to the board topic AND culturally appropriate!
-
-For abstract concepts (verbs, adjectives, pronouns), show them IN CONTEXT:
-- If board is about breakfast:
-  - "hot" → hot coffee or hot food, NOT the sun
-  - "cold" → cold milk or cold juice, NOT ice
-  - "eat" → person eating breakfast, NOT generic eating
-  - "drink" → person drinking from cup, NOT water bottle
-  - "I/you/he" → person at breakfast table in relevant pose
-
-SPECIAL HANDLING FOR EMOTIONAL CONCEPTS (to avoid AI safety filters):
-- "love" / "אהבה" → Show WHOLESOME family affection: parent hugging child, family holding hands, or heart-shaped object (like a heart-shaped cushion or drawing). NEVER romantic love. Use phrases like "parent lovingly hugging young child" or "family showing affection with a hug"
-- "friendship" / "חברות" → Children playing together, sharing toys, or holding hands while playing
-- "happiness" / "שמחה" → Smiling child with arms raised in joy, or child laughing while playing
-- "care" / "דאגה" → Parent gently tending to child (e.g., bandaging knee, comforting)
-These concepts MUST be depicted in INNOCENT, WHOLESOME, FAMILY-APPROPRIATE ways that clearly pass content safety filters.
-
-For each entity, create a detailed prompt optimized for Google's Gemini image generation that:
-- Describes a single, clear scene or object on white background
-- Uses {image_style} style (realistic/explicit if patient can't read; clean/friendly otherwise)
-- Is age-appropriate for {patient_profile.get('age', 10)} year old
-- No text, logos, or watermarks in image
-- Explicit, recognizable representation (not icons or symbols)
-- ALWAYS relates abstract concepts to the board's context (breakfast, emotions, etc.)
-- If the image is related to a known public figure, use comics style in the prompt and the image should be a cartoon.
-
-You must return a list of prompts, one for each entity provided.
-"""
-
-    user_msg = f"Create image prompts for these entities: {json.dumps(entities, ensure_ascii=False)}"
+    system_prompt = _IMAGE_PROMPTS_SYSTEM_TEMPLATE.format(
+        profile_section=profile_section,
+        image_style=image_style,
+        board_context=board_context if board_context else "general",
+        age=patient_profile.get('age', 10),
+    )
 
     # Generate schema with additionalProperties: false for OpenAI strict mode
     schema = ImagePromptsResponse.model_json_schema()
@@ -293,31 +331,59 @@ You must return a list of prompts, one for each entity provided.
     
     add_additional_properties_false(schema)
     
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_msg}
-        ],
-        response_format={
-            "type": "json_schema",
-            "json_schema": {
-                "name": "image_prompts_response",
-                "schema": schema,
-                "strict": True
-            }
-        },
-        temperature=0.7,
-    )
-    
-    logger.debug("OpenAI response received", response_preview=response.choices[0].message.content[:200])
-    
-    # Parse using Pydantic for guaranteed structure
-    parsed = ImagePromptsResponse.model_validate_json(response.choices[0].message.content)
-    
-    # Convert to the expected format
-    prompts = [{"entity": p.entity, "prompt": p.prompt} for p in parsed.prompts]
-    
-    logger.info("Image prompts extracted", prompt_count=len(prompts))
+    async def _prompt_chunk(chunk: List[str]) -> List[Dict[str, str]]:
+        # Numbered slots let the model (and us) keep one prompt per entity, in order
+        numbered = "\n".join(f"[{i}] {entity}" for i, entity in enumerate(chunk, start=1))
+        user_msg = (
+            f"Create image prompts for these {len(chunk)} entities, "
+            f"returning exactly one prompt per slot in the same order:\n{numbered}"
+        )
+
+        async with _prompt_slots:
+            response = await client.chat.completions.create(
+                model=PROMPTS_MODEL,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_msg}
+                ],
+                response_format={
+                    "type": "json_schema",
+                    "json_schema": {
+                        "name": "image_prompts_response",
+                        "schema": schema,
+                        "strict": True
+                    }
+                },
+                temperature=PROMPTS_TEMPERATURE,
+            )
+        
+        logger.debug("OpenAI response received", response_preview=response.choices[0].message.content[:200])
+        
+        # Parse using Pydantic for guaranteed structure
+        parsed = ImagePromptsResponse.model_validate_json(response.choices[0].message.content)
+        
+        # Map prompts back onto the requested entities: by name first, then by slot position.
+        # The board needs exactly one image per entity, so any gap gets a plain prompt.
+        by_entity = {p.entity.strip(): p.prompt for p in parsed.prompts}
+        prompts = []
+        missing = 0
+        for i, entity in enumerate(chunk):
+            prompt = by_entity.get(str(entity).strip())
+            if prompt is None and i < len(parsed.prompts):
+                prompt = parsed.prompts[i].prompt
+            if prompt is None:
+                missing += 1
+                prompt = f"A realistic {entity} on white background"
+            prompts.append({"entity": entity, "prompt": prompt})
+
+        if missing:
+            logger.warning("LLM returned fewer prompts than entities", missing=missing, entity_count=len(chunk))
+        return prompts
+
+    # Every board layout fits in one chunk; only oversized requests fan out into parallel calls
+    chunks = [entities[i:i + PROMPT_CHUNK_SIZE] for i in range(0, len(entities), PROMPT_CHUNK_SIZE)]
+    results = await asyncio.gather(*(_prompt_chunk(chunk) for chunk in chunks))
+    prompts = [prompt for chunk_prompts in results for prompt in chunk_prompts]
+
+    logger.info("Image prompts extracted", prompt_count=len(prompts), chunk_count=len(chunks))
     return prompts
-
@@ -0,0 +1,142 @@
+import functools
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+from pydantic import BaseModel
+
+import orjson
+
+from ..logger import logger
+
+
+# Max distinct LLM responses kept in memory (least recently used are evicted first)
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 1024))
+# Set to 1/true to always call the model (e.g. while iterating on prompts)
+LLM_CACHE_DISABLED = os.getenv("LLM_CACHE_DISABLED", "").lower() in ("1", "true", "yes")
+
+
+class LLMCache:
+    """Bounded LRU cache of JSON-encoded LLM results with a per-entry TTL"""
+
+    def __init__(self, max_entries: int = LLM_CACHE_MAX_ENTRIES) -> None:
+        self._max_entries = max_entries
+        # Only touched from the event loop, so no lock is needed
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: str, ttl: float) -> None:
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+
+class RedisLLMCache:
+    """Shared tier so every worker (and restarts) reuse the same LLM answers"""
+
+    def __init__(self, url: str) -> None:
+        import redis.asyncio as redis
+
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+
+    @staticmethod
+    def _key(key: str) -> str:
+        return f"cfi:llm:{key}"
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self._redis.get(self._key(key))
+
+    async def set(self, key: str, value: str, ttl: float) -> None:
+        await self._redis.set(self._key(key), value, ex=int(ttl))
+
+
+llm_cache = LLMCache()
+_shared_cache = RedisLLMCache(os.environ["REDIS_URL"]) if os.getenv("REDIS_URL") else None
+
+
+async def _shared_get(key: str) -> Optional[str]:
+    # Redis is an optimization here: if it's down, fall back to the local tier / the model
+    try:
+        return await _shared_cache.get(key)
+    except Exception as exc:
+        logger.warning("LLM cache read from Redis failed", error=str(exc))
+        return None
+
+
+async def _shared_set(key: str, value: str, ttl: float) -> None:
+    try:
+        await _shared_cache.set(key, value, ttl)
+    except Exception as exc:
+        logger.warning("LLM cache write to Redis failed", error=str(exc))
+
+
+def _dumps(value: Any, sort_keys: bool = False) -> str:
+    # Non-ASCII (Hebrew/Arabic) is emitted as-is, like ensure_ascii=False
+    return orjson.dumps(value, default=str, option=orjson.OPT_SORT_KEYS if sort_keys else 0).decode("utf-8")
+
+
+def _canonical(value: Any) -> Any:
+    """Reduce call arguments to plain JSON data so equivalent inputs hash the same"""
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, Mapping):
+        return {str(k): _canonical(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    return value
+
+
+def cache_key(fn_name: str, args: tuple, kwargs: dict, extra: dict) -> str:
+    payload = {"fn": fn_name, "extra": extra, "args": _canonical(args), "kwargs": _canonical(kwargs)}
+    raw = _dumps(payload, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def cached(ttl: float = 3600, **key_extra: Any) -> Callable[[Callable[..., Awaitable[Any]]], Callable[..., Awaitable[Any]]]:
+    """
+    Memoize an async LLM call on its (canonicalized) arguments.
+    `key_extra` (model, temperature, ...) is part of the key, so changing them invalidates old entries.
+    Results are stored as JSON, so every hit hands back a fresh copy the caller may mutate.
+    """
+    def decorator(fn: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+        if LLM_CACHE_DISABLED:
+            return fn
+
+        @functools.wraps(fn)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            key = cache_key(fn.__name__, args, kwargs, key_extra)
+            hit = llm_cache.get(key)
+            if hit is None and _shared_cache is not None:
+                hit = await _shared_get(key)
+                if hit is not None:
+                    llm_cache.set(key, hit, ttl)
+            if hit is not None:
+                logger.debug("LLM cache hit", fn=fn.__name__)
+                return orjson.loads(hit)
+
+            result = await fn(*args, **kwargs)
+            value = _dumps(result)
+            llm_cache.set(key, value, ttl)
+            if _shared_cache is not None:
+                await _shared_set(key, value, ttl)
+            return result
+
+        return wrapper
+
+    return decorator
@@ -5,13 +5,22 @@ from ..schemas import Preferences, ParsedBoard
 
 # Common topics with default entities
 TOPIC_DEFAULTS = {
-    "פירות": ["תפוח", "בננה", "תפוז", "אבטיח", "ענבים", "תות", "אגס", "דובדבן"],
-    "ירקות": ["עגבניה", "מלפפון", "גזר", "חסה", "פלפל", "בצל", "תפוח אדמה", "ברוקולי"],
-    "רגשות": ["שמח", "עצוב", "כועס", "מפחד", "רגוע", "מופתע", "עייף", "רעב"],
-    "בית": ["מטבח", "חדר שינה", "אמבטיה", "סלון", "גינה", "מיטה", "שולחן", "כיסא"],
-    "רפואי": ["כאב", "תרופה", "רופא", "אחות", "מזרק", "תחבושת", "חום", "לחץ דם"],
+    "פירות": ("תפוח", "בננה", "תפוז", "אבטיח", "ענבים", "תות", "אגס", "דובדבן"),
+    "ירקות": ("עגבניה", "מלפפון", "גזר", "חסה", "פלפל", "בצל", "תפוח אדמה", "ברוקולי"),
+    "רגשות": ("שמח", "עצוב", "כועס", "מפחד", "רגוע", "מופתע", "עייף", "רעב"),
+    "בית": ("מטבח", "חדר שינה", "אמבטיה", "סלון", "גינה", "מיטה", "שולחן", "כיסא"),
+    "רפואי": ("כאב", "תרופה", "רופא", "אחות", "מזרק", "תחבושת", "חום", "לחץ דם"),
 }
 
+BASIC_NEEDS = ("אוכל", "שתייה", "שירותים", "שינה", "כאב", "עזרה", "בית", "משחק")
+
+_SPLIT_STRICT = re.compile(r"[,;\n\r\t]+")
+_SPLIT_LOOSE = re.compile(r"[,;\s]+")
+# All topic keywords in one alternation, so the text is scanned once instead of once per topic
+_TOPIC_PATTERN = re.compile("|".join(re.escape(keyword) for keyword in TOPIC_DEFAULTS))
+# First-listed topic wins when several are mentioned
+_TOPIC_PRIORITY = {keyword: i for i, keyword in enumerate(TOPIC_DEFAULTS)}
+
 
 def parse_description(text: str, preferences: Optional[Preferences]) -> ParsedBoard:
     # Parse Hebrew descriptions intelligently
@@ -27,31 +36,30 @@ def parse_description(text: str, preferences: Optional[Preferences]) -> ParsedBo
     # Check if description contains explicit list of items
     # Look for newlines, commas, semicolons
     if "\n" in text or "," in text or ";" in text:
-        parts = re.split(r"[,;\n\r\t]+", text)
+        parts = _SPLIT_STRICT.split(text)
         entities = [p.strip() for p in parts if p.strip() and len(p.strip()) > 1]
     
     # Check for topic keywords and generate defaults
     if not entities:
-        for keyword, defaults in TOPIC_DEFAULTS.items():
-            if keyword in lowered:
-                topic = keyword
-                entities = defaults.copy()
-                break
+        hits = _TOPIC_PATTERN.findall(lowered)
+        if hits:
+            topic = min(hits, key=_TOPIC_PRIORITY.__getitem__)
+            entities = list(TOPIC_DEFAULTS[topic])
     
     # If still no entities, try to extract from natural language
     if not entities:
         # Look for patterns like "בנושא X" or "עם X"
         if "בנושא" in lowered:
             # Default to basic needs
-            entities = ["אוכל", "שתייה", "שירותים", "שינה", "כאב", "עזרה", "בית", "משחק"]
+            entities = list(BASIC_NEEDS)
         else:
             # Parse as comma/space separated list
-            parts = re.split(r"[,;\s]+", text)
+            parts = _SPLIT_LOOSE.split(text)
             entities = [p.strip() for p in parts if p.strip() and len(p.strip()) > 2]
     
     # Final fallback
     if not entities:
-        entities = ["אוכל", "שתייה", "שירותים", "שינה", "כאב", "עזרה", "בית", "משחק"]
+        entities = list(BASIC_NEEDS)
 
     # Cap to layout size
     if layout == "2x4":
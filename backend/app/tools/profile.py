@@ -3,8 +3,6 @@ from ..schemas import PatientProfile, Preferences
 
 
 def normalize_profile(profile: PatientProfile, preferences: Preferences | None) -> Dict:
-    data = profile.model_dump() if hasattr(profile, "model_dump") else dict(profile)
-
     labels_languages: List[str] = ["hebrew"]
     second = None
     if preferences and preferences.second_language:
@@ -17,7 +15,7 @@ def normalize_profile(profile: PatientProfile, preferences: Preferences | None)
         labels_languages.append(second)
 
     # Image style: explicit, non-icon imagery when can_read is False
-    can_read = data.get("can_read")
+    can_read = profile.can_read
     image_style = "realistic_explicit" if can_read is False else "cartoon_clean"
 
     return {
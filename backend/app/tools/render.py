@@ -1,16 +1,34 @@
-import uuid
+import math
+import os
+import queue
+import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from io import BytesIO
 from pathlib import Path
-from typing import List, Dict, Tuple, Optional
+from secrets import token_hex
+from typing import BinaryIO, List, Dict, Tuple, Optional, Union
 
 from PIL import Image, ImageDraw, ImageFont
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A5
 from bidi.algorithm import get_display
 import arabic_reshaper
 
 from ..logger import logger
 
 
+# Cell images are independent until they're pasted, so decode/resize them in parallel
+# (Pillow releases the GIL while decoding and resampling)
+_DECODE_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="board-decode")
+
+TITLE_FONT_SIZE = 40
+LABEL_FONT_SIZE = 22
+# JPEG quality of the board image embedded in the PDF (the PNG stays lossless)
+PDF_JPEG_QUALITY = 85
+# Anything that isn't safe in an asset filename
+_UNSAFE_PREFIX_CHARS = re.compile(r"[^A-Za-z0-9_-]+")
+# Hebrew (U+0590-05FF) and Arabic (U+0600-06FF) blocks, adjacent so one range covers both
+_RTL_CHARS = re.compile("[\u0590-\u06FF]")
+
 def _grid_for_layout(layout: str) -> Tuple[int, int]:
     if layout == "2x4":
         return 2, 4  # rows, cols
@@ -19,46 +37,67 @@ def _grid_for_layout(layout: str) -> Tuple[int, int]:
     return 2, 4
 
 
-def _safe_font(size: int):
-    """Load a font that supports Hebrew characters"""
-    # Try Hebrew-compatible fonts in order of preference
-    font_options = [
-        # macOS fonts
-        "/System/Library/Fonts/Supplemental/Arial Unicode.ttf",
-        "/System/Library/Fonts/Helvetica.ttc",
-        "/System/Library/Fonts/Arial.ttf",
-        # Linux fonts
-        "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
-        "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
-        # Noto Sans (good Hebrew support)
-        "/usr/share/fonts/truetype/noto/NotoSans-Regular.ttf",
-        "Arial.ttf",
-        "DejaVuSans.ttf",
-    ]
-    
-    for font_path in font_options:
+# Hebrew-compatible fonts in order of preference
+_FONT_OPTIONS = (
+    # macOS fonts
+    "/System/Library/Fonts/Supplemental/Arial Unicode.ttf",
+    "/System/Library/Fonts/Helvetica.ttc",
+    "/System/Library/Fonts/Arial.ttf",
+    # Linux fonts
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
+    # Noto Sans (good Hebrew support)
+    "/usr/share/fonts/truetype/noto/NotoSans-Regular.ttf",
+    "Arial.ttf",
+    "DejaVuSans.ttf",
+)
+
+
+@lru_cache(maxsize=1)
+def _resolve_font_path() -> Optional[str]:
+    """First font in _FONT_OPTIONS that loads; probed once per process, not once per size"""
+    for font_path in _FONT_OPTIONS:
         try:
-            font = ImageFont.truetype(font_path, size)
-            logger.debug("Font loaded", font_path=font_path, size=size)
-            return font
+            ImageFont.truetype(font_path, LABEL_FONT_SIZE)
         except (OSError, IOError):
             continue
-    
+        logger.debug("Font loaded", font_path=font_path)
+        return font_path
+
     # Fallback to default (may not support Hebrew)
     logger.warning("Could not load Hebrew-compatible font, using default")
-    return ImageFont.load_default()
+    return None
+
+
+@lru_cache(maxsize=16)
+def _safe_font(size: int):
+    """Load a font that supports Hebrew characters (cached per size)"""
+    font_path = _resolve_font_path()
+    if font_path is None:
+        return ImageFont.load_default()
+    return ImageFont.truetype(font_path, size)
+
+
+@lru_cache(maxsize=4096)
+def _text_width(font_size: int, text: str) -> float:
+    """Advance width of text in _safe_font(font_size); labels repeat across cells and boards"""
+    # Only the width is needed for centering (rows sit at fixed offsets), and getlength
+    # skips the rasterization textbbox does
+    return _safe_font(font_size).getlength(text)
 
 
 def _prepare_text_for_display(text: str) -> str:
     """Prepare text for display, handling RTL languages like Hebrew and Arabic"""
     if not text:
         return text
-    
+    return _bidi_shape(text)
+
+
+@lru_cache(maxsize=1024)
+def _bidi_shape(text: str) -> str:
+    """Reshape/reorder one string; titles and labels repeat across cells and boards"""
     # Check if text contains Hebrew or Arabic characters
-    has_hebrew = any('\u0590' <= c <= '\u05FF' for c in text)
-    has_arabic = any('\u0600' <= c <= '\u06FF' for c in text)
-    
-    if has_hebrew or has_arabic:
+    if _RTL_CHARS.search(text):
         # For Hebrew/Arabic, we need to reverse the text for PIL rendering
         # PIL doesn't natively support RTL, so we reverse the string
         # This works because Hebrew/Arabic fonts render characters correctly
@@ -79,7 +118,7 @@ def _prepare_text_for_display(text: str) -> str:
 def _build_prefix(prefix: Optional[str]) -> str:
     if not prefix:
         return ""
-    safe = "".join(ch for ch in str(prefix) if ch.isalnum() or ch in {"-", "_"})
+    safe = _UNSAFE_PREFIX_CHARS.sub("", str(prefix))
     if not safe:
         return ""
     if not safe.endswith("_"):
@@ -87,6 +126,149 @@ def _build_prefix(prefix: Optional[str]) -> str:
     return safe
 
 
+def _load_cell_image(img_file: Union[Path, BinaryIO], size: Tuple[int, int]) -> Image.Image:
+    try:
+        img = Image.open(img_file)
+        # JPEG can decode straight at a reduced scale (a no-op for PNG); keep 2x headroom,
+        # as thumbnail's own reducing_gap would, so the final resample still antialiases
+        img.draft("RGB", (size[0] * 2, size[1] * 2))
+        # Decode here rather than lazily in thumbnail(), so truncated/corrupt files
+        # still land in the gray fallback below
+        img.load()
+        # Gemini and placeholder PNGs are already RGB, so skip the extra copy
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+    except Exception:
+        img = Image.new("RGB", (512, 512), color=(230, 230, 230))
+    # Fit image into area (with some padding); bilinear is plenty for a ~400px cell, and it's
+    # one of the filters Pillow-SIMD vectorizes if that's installed in place of Pillow
+    img.thumbnail(size, Image.Resampling.BILINEAR)
+    return img
+
+
+@lru_cache(maxsize=32)
+def _load_thumb(path: str, size: Tuple[int, int], mtime_ns: int) -> Image.Image:
+    """
+    Thumbnailed image file, reused while the file is unchanged (re-renders of a board).
+    Callers only paste from it, so the shared image is never mutated.
+    """
+    return _load_cell_image(Path(path), size)
+
+
+@lru_cache(maxsize=1024)
+def _text_sprite(font_size: int, text: str, frac_x: float) -> Tuple[Image.Image, int, int]:
+    """
+    Antialiased coverage mask of text as draw.text would rasterize it at x-fraction `frac_x`, and the
+    padding to subtract when pasting it. Labels repeat across cells and boards, so FreeType runs once.
+    """
+    font = _safe_font(font_size)
+    left, top, right, bottom = ImageDraw.Draw(Image.new("L", (1, 1))).textbbox((0, 0), text, font=font)
+    # Room for glyphs that reach left of / above the origin (negative bearings, marks)
+    pad_x = max(0, -math.floor(left)) + 1
+    pad_y = max(0, -math.floor(top)) + 1
+    mask = Image.new("L", (math.ceil(right + frac_x) + pad_x + 1, math.ceil(bottom) + pad_y + 1))
+    ImageDraw.Draw(mask).text((frac_x + pad_x, pad_y), text, fill=255, font=font)
+    return mask, pad_x, pad_y
+
+
+def _draw_text(board: Image.Image, xy: Tuple[float, int], text: str, font_size: int, fill: Tuple[int, int, int]) -> None:
+    """Same pixels as ImageDraw.text(xy, text, fill, font), from a cached mask"""
+    x, y = xy
+    ix = math.floor(x)
+    mask, pad_x, pad_y = _text_sprite(font_size, text, x - ix)
+    board.paste(fill, (ix - pad_x, y - pad_y), mask)
+
+
+@lru_cache(maxsize=4)
+def _cell_background(width: int, height: int) -> Image.Image:
+    """
+    One rounded cell on the board's white background, pasted at every grid position.
+    The corners stay white, which is what the board already is between cells.
+    """
+    # rounded_rectangle includes its end coordinates, hence the extra pixel each way
+    cell = Image.new("RGB", (width + 1, height + 1), color=(255, 255, 255))
+    ImageDraw.Draw(cell).rounded_rectangle(
+        [0, 0, width, height], radius=16, fill=(245, 247, 250), outline=(220, 224, 230)
+    )
+    return cell
+
+
+# Finished boards hand their buffer back for the next board of the same size (one per
+# layout in practice), so a busy server isn't allocating ~5 MB images for every render
+_BOARD_POOL_PER_SIZE = 2
+_board_pool: Dict[Tuple[int, int], queue.LifoQueue] = {}
+
+
+def _acquire_board(size: Tuple[int, int]) -> Image.Image:
+    pool = _board_pool.get(size)
+    if pool is None:
+        pool = _board_pool.setdefault(size, queue.LifoQueue(maxsize=_BOARD_POOL_PER_SIZE))
+    try:
+        board = pool.get_nowait()
+    except queue.Empty:
+        return Image.new("RGB", size, color=(255, 255, 255))
+    board.paste((255, 255, 255), (0, 0) + size)
+    return board
+
+
+def _release_board(board: Image.Image) -> None:
+    # A board lost to an exception is simply garbage-collected; the pool is only a shortcut
+    try:
+        _board_pool[board.size].put_nowait(board)
+    except queue.Full:
+        pass
+
+
+@lru_cache(maxsize=16)
+def _title_strip(title: str, width: int, height: int, top: float) -> Image.Image:
+    """White band with the centered title; shared across boards, so callers only paste from it"""
+    strip = Image.new("RGB", (width, height), color=(255, 255, 255))
+    # Title (prepare for RTL if needed)
+    display_title = _prepare_text_for_display(title)
+    tw = _text_width(TITLE_FONT_SIZE, display_title)
+    ImageDraw.Draw(strip).text(
+        ((width - tw) / 2, top), display_title, fill=(20, 20, 20), font=_safe_font(TITLE_FONT_SIZE)
+    )
+    return strip
+
+
+@lru_cache(maxsize=1)
+def _reportlab():
+    """Import ReportLab on first PDF (so the PNG path doesn't pay its import cost) and configure it once"""
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import A5
+    from reportlab.lib.utils import ImageReader
+    from reportlab import rl_config
+
+    # ReportLab ASCII85-wraps image streams by default (for 7-bit-safe files), which inflates the
+    # embedded JPEG by ~25%; binary PDFs open fine in every current viewer. rl_config is
+    # process-global, so this applies to every ReportLab user in the process — set it here once
+    # rather than from the PDF pool threads on every write.
+    rl_config.useA85 = 0
+    return canvas, A5, ImageReader
+
+
+def _write_pdf(board: Image.Image, pdf_path: Path) -> None:
+    # Save PDF with ReportLab (place the PNG to fill page width)
+    canvas, A5, ImageReader = _reportlab()
+
+    # Written under a temporary name and moved into place, so the file never appears half-written
+    tmp_path = pdf_path.with_name(f"{pdf_path.name}.tmp")
+    c = canvas.Canvas(str(tmp_path), pagesize=A5, pageCompression=1)
+    pw, ph = A5  # in points
+    # Convert pixels to points (assume ~96 dpi → 0.75 factor); simple fit by width
+    pt_per_px = pw / board.width
+    img_height_pts = board.height * pt_per_px
+    # Embed a JPEG rather than the raw pixels: ReportLab passes JPEG data through as-is, so the
+    # PDF is several times smaller and quicker to write. No chroma subsampling keeps labels crisp.
+    jpeg_buf = BytesIO()
+    board.save(jpeg_buf, format="JPEG", quality=PDF_JPEG_QUALITY, subsampling=0)
+    c.drawImage(ImageReader(jpeg_buf), 0, ph - img_height_pts, width=pw, height=img_height_pts)
+    c.showPage()
+    c.save()
+    os.replace(tmp_path, pdf_path)
+
+
 def render_board(
     layout: str,
     title: str,
@@ -95,7 +277,9 @@ def render_board(
     labels_per_entity: List[Dict[str, str]],
     assets_dir: str,
     prefix: Optional[str] = None,
+    image_bytes: Optional[Dict[str, bytes]] = None,
 ) -> Tuple[str, str]:
+    """Draw the board and save it as PNG + PDF; returns both filenames"""
     rows, cols = _grid_for_layout(layout)
     cell_w, cell_h = 400, 420
     margin, gutter = 40, 20
@@ -103,78 +287,75 @@ def render_board(
     width = margin * 2 + cols * cell_w + (cols - 1) * gutter
     height = margin * 2 + rows * cell_h + (rows - 1) * gutter + 80  # title area
 
-    board = Image.new("RGB", (width, height), color=(255, 255, 255))
-    draw = ImageDraw.Draw(board)
-    font_title = _safe_font(40)
-    font_label = _safe_font(22)
+    board = _acquire_board((width, height))
 
-    # Title (prepare for RTL if needed)
-    display_title = _prepare_text_for_display(title)
-    tb = draw.textbbox((0, 0), display_title, font=font_title)
-    tw, th = tb[2] - tb[0], tb[3] - tb[1]
-    draw.text(((width - tw) / 2, margin / 2), display_title, fill=(20, 20, 20), font=font_title)
+    # Title band above the cells, reused while the title and board width repeat
+    board.paste(_title_strip(title, width, margin + 80, margin / 2), (0, 0))
 
     # Place cells
     assets = Path(assets_dir)
-    for idx, (entity, labels) in enumerate(zip(entities, labels_per_entity)):
-        r = idx // cols
-        c = idx % cols
-        if r >= rows:
-            break
+    assets.mkdir(parents=True, exist_ok=True)
+    area_h = cell_h - 60
+    area_w = cell_w - 20
+    # Cells that have everything they need and fit the grid; the loop below runs exactly this many
+    cell_count = min(len(entities), len(labels_per_entity), len(image_paths), rows * cols)
+    # Images generated in this process are decoded from memory; anything else is read from disk
+    image_bytes = image_bytes or {}
+
+    def _cell_image(name: str) -> Image.Image:
+        raw = image_bytes.get(name)
+        if raw is not None:
+            return _load_cell_image(BytesIO(raw), (area_w, area_h))
+        img_file = assets / name
+        try:
+            mtime_ns = img_file.stat().st_mtime_ns
+        except OSError:
+            # Missing file: the loader falls back to a gray cell
+            return _load_cell_image(img_file, (area_w, area_h))
+        return _load_thumb(str(img_file), (area_w, area_h), mtime_ns)
+
+    cell_images = list(_DECODE_POOL.map(_cell_image, image_paths[:cell_count]))
+    cell_bg = _cell_background(cell_w, cell_h)
+    for idx in range(cell_count):
+        entity, labels = entities[idx], labels_per_entity[idx]
+        r, c = divmod(idx, cols)
         x = margin + c * (cell_w + gutter)
         y = margin + 80 + r * (cell_h + gutter)
 
         # Cell background
-        draw.rounded_rectangle([x, y, x + cell_w, y + cell_h], radius=16, fill=(245, 247, 250), outline=(220, 224, 230))
+        board.paste(cell_bg, (x, y))
 
         # Image
-        img_file = assets / image_paths[idx]
-        try:
-            img = Image.open(img_file).convert("RGB")
-        except Exception:
-            img = Image.new("RGB", (512, 512), color=(230, 230, 230))
-        # Fit image into area (with some padding)
-        area_h = cell_h - 60
-        area_w = cell_w - 20
-        img.thumbnail((area_w, area_h))
+        img = cell_images[idx]
         ix = x + (cell_w - img.width) // 2
         iy = y + 10
         board.paste(img, (ix, iy))
 
         # Labels: Hebrew on first line, second language (if any) below
-        langs = list(labels.keys())
-        line1 = labels.get(langs[0], entity)
-        line2 = labels.get(langs[1], "") if len(langs) > 1 else ""
+        texts = iter(labels.values())
+        line1 = next(texts, entity)
+        line2 = next(texts, "")
 
         # Prepare text for RTL display
         display_line1 = _prepare_text_for_display(line1)
-        lb1 = draw.textbbox((0, 0), display_line1, font=font_label)
-        lw1, lh1 = lb1[2] - lb1[0], lb1[3] - lb1[1]
-        draw.text((x + (cell_w - lw1) / 2, y + cell_h - 45), display_line1, fill=(30, 30, 30), font=font_label)
+        lw1 = _text_width(LABEL_FONT_SIZE, display_line1)
+        _draw_text(board, (x + (cell_w - lw1) / 2, y + cell_h - 45), display_line1, LABEL_FONT_SIZE, (30, 30, 30))
 
         if line2:
             display_line2 = _prepare_text_for_display(line2)
-            lb2 = draw.textbbox((0, 0), display_line2, font=font_label)
-            lw2, _ = lb2[2] - lb2[0], lb2[3] - lb2[1]
-            draw.text((x + (cell_w - lw2) / 2, y + cell_h - 22), display_line2, fill=(60, 60, 60), font=font_label)
+            lw2 = _text_width(LABEL_FONT_SIZE, display_line2)
+            _draw_text(board, (x + (cell_w - lw2) / 2, y + cell_h - 22), display_line2, LABEL_FONT_SIZE, (60, 60, 60))
 
     # Save PNG
-    name_prefix = _build_prefix(prefix)
-    png_name = f"{name_prefix}board_{uuid.uuid4().hex[:8]}.png"
-    pdf_name = f"{name_prefix}board_{uuid.uuid4().hex[:8]}.pdf"
-    assets.mkdir(parents=True, exist_ok=True)
-    board.save(assets / png_name, format="PNG")
+    # One id for both files so a board's PNG and PDF are easy to pair up
+    stem = f"{_build_prefix(prefix)}board_{token_hex(4)}"
+    png_name = f"{stem}.png"
+    pdf_name = f"{stem}.pdf"
+    # Boards are regenerated on demand, so fast zlib beats a few percent of file size
+    board.save(assets / png_name, format="PNG", optimize=False, compress_level=1)
 
-    # Save PDF with ReportLab (place the PNG to fill page width)
-    c = canvas.Canvas(str(assets / pdf_name), pagesize=A5)
-    pw, ph = A5  # in points
-    # Convert pixels to points (assume ~96 dpi → 0.75 factor); simple fit by width
-    scale = pw / board.width
-    img_height_pts = board.height * scale
-    # drawImage expects a file path
-    c.drawImage(str(assets / png_name), 0, ph - img_height_pts, width=pw, height=img_height_pts)
-    c.showPage()
-    c.save()
+    _write_pdf(board, assets / pdf_name)
+    _release_board(board)
 
     return png_name, pdf_name
 
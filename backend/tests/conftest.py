@@ -0,0 +1,15 @@
+import os
+import shutil
+import tempfile
+
+# The app resolves its asset and log directories at import time, so point them at a scratch
+# directory before any test imports it; test runs never touch the repository's assets/ or logs/
+_SCRATCH = tempfile.mkdtemp(prefix="schneider-cfi-tests-")
+os.environ["ASSETS_PATH"] = os.path.join(_SCRATCH, "assets")
+os.environ["SESSION_LOG_PATH"] = os.path.join(_SCRATCH, "session-logs")
+os.environ["APP_LOG_PATH"] = os.path.join(_SCRATCH, "app-logs")
+os.environ.pop("REDIS_URL", None)
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(_SCRATCH, ignore_errors=True)
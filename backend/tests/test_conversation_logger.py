@@ -0,0 +1,43 @@
+import json
+
+import pytest
+
+from app.tools import conversation_logger
+
+
+@pytest.fixture
+def session_logs(tmp_path, monkeypatch):
+    """Swap in a writer and session shards of our own, with every log file under tmp_path"""
+    conversation_logger.flush()
+    for name in ("KPI_FILE", "DETAIL_FILE", "FEEDBACK_FILE"):
+        target = getattr(conversation_logger, name)
+        monkeypatch.setattr(conversation_logger, name, tmp_path / target.name)
+    monkeypatch.setattr(conversation_logger, "_SHARDS", [
+        (lock, {}) for lock, _ in conversation_logger._SHARDS
+    ])
+    writer = conversation_logger._LogWriter()
+    monkeypatch.setattr(conversation_logger, "_writer", writer)
+    yield writer
+    if writer.is_alive():
+        writer.close()
+
+
+def test_entries_after_a_failed_write_still_land(session_logs, tmp_path, monkeypatch):
+    real_write = conversation_logger._AppendLog.write
+    calls = []
+
+    def flaky_write(self, record):
+        calls.append(record)
+        if len(calls) == 1:
+            raise OSError("disk hiccup")
+        real_write(self, record)
+
+    monkeypatch.setattr(conversation_logger._AppendLog, "write", flaky_write)
+    # Queued before the writer starts, so all three land in one batch
+    for n in (1, 2, 3):
+        conversation_logger._write_ndjson({"n": n})
+    session_logs.start()
+    conversation_logger.flush()
+
+    lines = (tmp_path / "conversation_details.ndjson").read_text(encoding="utf-8").splitlines()
+    assert [json.loads(line)["n"] for line in lines] == [2, 3]
@@ -0,0 +1,91 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app import main, orchestrator
+
+BODY = {
+    "parsed": {"layout": "2x4", "entities": ["לחם"]},
+    "profile": {"labels_languages": ["hebrew"], "image_style": "x"},
+    "title": "לוח",
+    "session_id": "test-session",
+}
+
+
+def test_blocking_generate_is_refused_once_backlog_is_full(monkeypatch):
+    monkeypatch.setattr(main, "GENERATION_MAX_CONCURRENCY", 1)
+    monkeypatch.setattr(main, "GENERATION_MAX_QUEUED", 1)
+    monkeypatch.setattr(main, "_generation_slots", asyncio.Semaphore(1))
+
+    async def run():
+        release = asyncio.Event()
+
+        async def blocked(req, assets_dir, job_id=None):
+            await release.wait()
+            raise RuntimeError("stopped")
+
+        monkeypatch.setattr(orchestrator, "handle_generate", blocked)
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            # One job takes the slot, the other waits in the queue
+            for _ in range(2):
+                assert (await client.post("/api/boards/generate/start", json=BODY)).status_code == 200
+            # Without the bound this would wait for a slot instead of being refused
+            resp = await asyncio.wait_for(client.post("/api/boards/generate", json=BODY), timeout=5)
+            assert resp.status_code == 429
+
+            release.set()
+            await asyncio.gather(*main._background_jobs)
+        assert main._admitted_jobs == 0
+
+    asyncio.run(run())
+
+
+def _get_details(headers):
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get(
+                "/api/admin/logs/details",
+                headers={"Authorization": f"Bearer {main.ADMIN_TOKEN}", **headers},
+            )
+
+    return asyncio.run(run())
+
+
+@pytest.fixture
+def details_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "LOG_DIR", tmp_path)
+    path = tmp_path / "conversation_details.ndjson"
+    path.write_text('{"session_id": "s1"}\n' * 200, encoding="utf-8")
+    return path
+
+
+def test_details_answer_304_for_matching_etag(details_file):
+    first = _get_details({"Accept-Encoding": "identity"})
+    assert first.status_code == 200
+    again = _get_details({"Accept-Encoding": "identity", "If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 304
+    assert again.content == b""
+
+
+def test_details_gzip_body_has_its_own_etag(details_file):
+    plain = _get_details({"Accept-Encoding": "identity"})
+    zipped = _get_details({"Accept-Encoding": "gzip"})
+    assert zipped.headers["Content-Encoding"] == "gzip"
+    assert zipped.headers["Vary"] == "Accept-Encoding"
+    # httpx decodes the body transparently
+    assert zipped.content == details_file.read_bytes()
+    assert zipped.headers["ETag"] != plain.headers["ETag"]
+    # The plain representation's ETag doesn't validate the gzip one
+    stale = _get_details({"Accept-Encoding": "gzip", "If-None-Match": plain.headers["ETag"]})
+    assert stale.status_code == 200
+
+
+@pytest.mark.parametrize("accept_encoding", ["gzip;q=0", "identity, gzip;q=0", "*;q=0"])
+def test_details_not_gzipped_when_client_refuses_it(details_file, accept_encoding):
+    resp = _get_details({"Accept-Encoding": accept_encoding})
+    assert resp.status_code == 200
+    assert "Content-Encoding" not in resp.headers
+    assert resp.content == details_file.read_bytes()
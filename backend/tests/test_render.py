@@ -0,0 +1,64 @@
+from io import BytesIO
+
+from PIL import Image
+
+from app.tools import render
+
+
+def _truncated_png() -> bytes:
+    buf = BytesIO()
+    Image.effect_noise((512, 512), 64).convert("RGB").save(buf, format="PNG")
+    data = buf.getvalue()
+    # Keep the header (so it passes the magic-prefix check) but cut the pixel data short
+    return data[: len(data) // 2]
+
+
+def _render(tmp_path, **kwargs):
+    png_name, _ = render.render_board(
+        layout="2x4",
+        title="לוח",
+        entities=["לחם"],
+        image_paths=["broken.png"],
+        labels_per_entity=[{"he": "לחם", "en": "bread"}],
+        assets_dir=str(tmp_path),
+        **kwargs,
+    )
+    return Image.open(tmp_path / png_name)
+
+
+def test_truncated_image_file_falls_back_to_gray_cell(tmp_path):
+    (tmp_path / "broken.png").write_bytes(_truncated_png())
+    board = _render(tmp_path)
+    assert board.size == (1740, 1020)
+    # Center of the first cell's image area is the gray placeholder
+    assert board.getpixel((240, 310)) == (230, 230, 230)
+
+
+def test_truncated_image_bytes_fall_back_to_gray_cell(tmp_path):
+    board = _render(tmp_path, image_bytes={"broken.png": _truncated_png()})
+    assert board.getpixel((240, 310)) == (230, 230, 230)
+
+
+def test_load_cell_image_decodes_inside_fallback():
+    img = render._load_cell_image(BytesIO(_truncated_png()), (380, 360))
+    assert img.size == (360, 360)
+    assert img.getpixel((10, 10)) == (230, 230, 230)
+
+
+def _render_names(tmp_path, **kwargs):
+    return render.render_board(
+        layout="2x4",
+        title="t",
+        entities=["a"],
+        image_paths=["missing.png"],
+        labels_per_entity=[{"he": "a"}],
+        assets_dir=str(tmp_path),
+        **kwargs,
+    )
+
+
+def test_pdf_exists_when_render_board_returns(tmp_path):
+    png_name, pdf_name = _render_names(tmp_path)
+    assert (tmp_path / png_name).is_file()
+    assert (tmp_path / pdf_name).read_bytes().startswith(b"%PDF")
+